@@ -1,20 +1,55 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-import cv2
 import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+import threading
+import queue
 import time
+import hashlib
+import bisect
+import contextvars
+import functools
+import importlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from itertools import cycle
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 import io
 import os
 import json
 import numpy as np
+import math
+import random
 import tempfile
+import shutil
 import uuid
-from google import genai
-from google.genai import types
 import base64
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
+from frame_decoder import decode_shard, scaled_size, shrink_frame
+
+class LazyModule:
+    """Stand-in for a heavy module that is only imported when first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        """Import the module now if nothing has touched it yet."""
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# OpenCV and the Gemini SDK take most of the import time, so they load on first use
+cv2 = LazyModule("cv2")
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+genai_errors = LazyModule("google.genai.errors")
 
 app = Flask(__name__)
 CORS(app)
@@ -27,12 +62,15 @@ API_KEY = os.getenv("API_KEY")
 MODEL_ID = "gemini-2.0-flash"
 
 # Configure safety settings
-safety_settings = [
-    types.SafetySetting(
-        category="HARM_CATEGORY_DANGEROUS_CONTENT",
-        threshold="BLOCK_ONLY_HIGH",
-    ),
-]
+@functools.lru_cache(maxsize=None)
+def safety_settings():
+    """Safety settings sent with every request, built once on first use."""
+    return [
+        types.SafetySetting(
+            category="HARM_CATEGORY_DANGEROUS_CONTENT",
+            threshold="BLOCK_ONLY_HIGH",
+        ),
+    ]
 
 # System instructions for bounding box detection
 bounding_box_system_instructions = """
@@ -66,10 +104,519 @@ crime_classification_system_instructions = """
     {"category": "normal", "confidence": 0.95, "description": "People walking peacefully in a park. No suspicious activity."}
 """
 
-# Create a temporary directory to store uploaded videos and processed images
-UPLOAD_FOLDER = tempfile.mkdtemp()
-PROCESSED_FOLDER = os.path.join(UPLOAD_FOLDER, "processed")
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+# Extra instructions when several frames are classified in one request
+batch_classification_system_instructions = crime_classification_system_instructions + """
+    You will receive several images, each preceded by a label such as "Frame 1:".
+    Classify every frame independently and return a JSON array with one object per frame, in order.
+    Each object has the fields above plus "frame": the frame's label number.
+
+    Format example:
+    [{"frame": 1, "category": "normal", "confidence": 0.95, "description": "..."}, {"frame": 2, "category": "fighting", "confidence": 0.8, "description": "..."}]
+"""
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 8))
+
+# Uploaded videos and processed images live under one directory bounded by a disk quota.
+# Sessions untouched for SESSION_TTL_SECONDS, or the least recently used ones once the
+# quota is exceeded, are deleted; sessions with a job still running are never evicted.
+# Several processes may share the directory, so running jobs are pinned with marker files
+# under pins/<process>/ that every process respects. A process refreshes its pin directory on
+# each sweep; pins not refreshed for STORAGE_PIN_TIMEOUT_SECONDS belong to a dead process.
+STORAGE_DIR = os.getenv("STORAGE_DIR", os.path.join(tempfile.gettempdir(), "rakshasetu-video"))
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", 2 * 1024 ** 3))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 3600))
+STORAGE_SWEEP_SECONDS = float(os.getenv("STORAGE_SWEEP_SECONDS", 60))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 1024 ** 3))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Usage is re-read from disk after this much is uploaded, to see what other processes wrote
+UPLOAD_RESCAN_BYTES = 64 * 1024 * 1024
+STORAGE_PIN_TIMEOUT_SECONDS = float(os.getenv("STORAGE_PIN_TIMEOUT_SECONDS", STORAGE_SWEEP_SECONDS * 3))
+
+class StorageFullError(Exception):
+    """Raised when an upload cannot fit in the storage quota even after eviction."""
+
+class UploadSpool(io.FileIO):
+    """An upload being written into storage under a temporary name, claiming quota as it grows."""
+
+    def __init__(self, manager, key, path):
+        super().__init__(path, "w+")
+        self.manager = manager
+        self.key = key
+        self.adopted = False
+
+    def write(self, data):
+        self.manager.reserve(len(data))
+        return super().write(data)
+
+class StorageManager:
+    """Disk storage for uploads and processed frames with a quota and LRU/TTL session eviction."""
+
+    def __init__(self, root=STORAGE_DIR, quota_bytes=STORAGE_QUOTA_BYTES, ttl_seconds=SESSION_TTL_SECONDS,
+                 pin_timeout=STORAGE_PIN_TIMEOUT_SECONDS):
+        self.root = root
+        self.uploads_dir = os.path.join(root, "uploads")
+        self.sessions_dir = os.path.join(root, "sessions")
+        self.pins_dir = os.path.join(root, "pins")
+        self.owner_pins_dir = os.path.join(self.pins_dir, uuid.uuid4().hex)
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.pin_timeout = pin_timeout
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self.used_bytes = 0
+        self.evicted = 0
+        self._written_since_sweep = 0
+
+    def upload_path(self, session_id):
+        return os.path.join(self.uploads_dir, f"{session_id}.mp4")
+
+    def session_dir(self, session_id):
+        path = os.path.join(self.sessions_dir, session_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def frame_path(self, session_id, filename):
+        return os.path.join(self.sessions_dir, session_id, filename)
+
+    def touch(self, session_id):
+        """Mark a session as recently used so LRU eviction keeps it."""
+        try:
+            os.utime(os.path.join(self.sessions_dir, session_id))
+        except OSError:
+            pass
+
+    def open_spool(self, key):
+        """Open a pinned file in the uploads directory that counts its bytes against the quota."""
+        self.pin(key)
+        try:
+            return UploadSpool(self, key, self.upload_path(key) + ".part")
+        except BaseException:
+            self._unpin(key)
+            raise
+
+    def discard_spool(self, spool):
+        """Delete a spool that was never kept as a session's upload."""
+        if spool.adopted:
+            return
+        spool.close()
+        self._remove(spool.name)
+        self._unpin(spool.key)
+
+    def save_upload(self, stream, session_id):
+        """Keep an upload as the session's source video and pin the session until release().
+
+        Multipart parts are already in storage, written there by UploadRequest, so they are
+        renamed into place; a raw body is copied from the request in fixed-size chunks.
+        """
+        if isinstance(stream, UploadSpool):
+            spool = stream
+        else:
+            spool = self.open_spool(session_id)
+            try:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    spool.write(chunk)
+            except BaseException:
+                self.discard_spool(spool)
+                raise
+        path = self.upload_path(session_id)
+        spool.close()
+        self.pin(session_id)
+        os.replace(spool.name, path)
+        spool.adopted = True
+        if spool.key != session_id:
+            self._unpin(spool.key)
+        return path
+
+    def reserve(self, nbytes):
+        """Claim quota for bytes about to be uploaded, evicting old sessions if they do not fit."""
+        with self._lock:
+            self.used_bytes += nbytes
+            self._written_since_sweep += nbytes
+            fits = self.used_bytes <= self.quota_bytes and self._written_since_sweep < UPLOAD_RESCAN_BYTES
+        if fits:
+            return
+        if self.sweep() + nbytes > self.quota_bytes:
+            raise StorageFullError("Not enough storage space for this video, try again later")
+        with self._lock:
+            self.used_bytes += nbytes
+
+    def pin(self, session_id):
+        """Exclude a session from eviction, in this process and every other one, until release()."""
+        with self._lock:
+            self._pinned.add(session_id)
+            os.makedirs(self.owner_pins_dir, exist_ok=True)
+            open(os.path.join(self.owner_pins_dir, session_id), "wb").close()
+
+    def release_upload(self, session_id):
+        """Delete a session's source video once every frame has been decoded from it."""
+        self._remove(self.upload_path(session_id))
+
+    def release(self, session_id):
+        """Delete a session's source video if it is still there and allow eviction again."""
+        self.release_upload(session_id)
+        self._unpin(session_id)
+
+    def _unpin(self, session_id):
+        with self._lock:
+            self._pinned.discard(session_id)
+            self._remove(os.path.join(self.owner_pins_dir, session_id))
+
+    def sweep(self):
+        """Delete orphaned uploads and expired sessions, then least recently used ones until usage fits the quota."""
+        now = time.time()
+        # Scan before reading pins: a session is pinned before its upload is written, so
+        # any upload seen here that is still in use has its pin visible below
+        sessions = self._scan()
+        uploads = list(os.scandir(self.uploads_dir))
+        pinned = self._live_pins()
+        for entry in uploads:
+            # Source videos only exist while a job reads them; unpinned ones were left by a dead process
+            if entry.name.split(".")[0] not in pinned:
+                self._remove(entry.path)
+        used = sum(size for _, size in sessions.values())
+        # Oldest first, so expired sessions always go before live ones
+        for session_id, (last_used, size) in sorted(sessions.items(), key=lambda item: item[1][0]):
+            if now - last_used <= self.ttl_seconds and used <= self.quota_bytes:
+                break
+            if session_id in pinned:
+                continue
+            self._delete_session(session_id)
+            used -= size
+            self.evicted += 1
+        with self._lock:
+            self.used_bytes = used
+            self._written_since_sweep = 0
+        return used
+
+    def stats(self):
+        with self._lock:
+            pinned = len(self._pinned)
+        return {
+            "used_bytes": self.used_bytes,
+            "quota_bytes": self.quota_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "active_sessions": pinned,
+            "evicted_sessions": self.evicted,
+        }
+
+    def _scan(self):
+        # Session ID -> [last used time, bytes on disk], from the upload and the frames directory
+        sessions = {}
+
+        def record(session_id, entry):
+            try:
+                stat = entry.stat()
+            except OSError:
+                return
+            usage = sessions.setdefault(session_id, [0, 0])
+            usage[0] = max(usage[0], stat.st_mtime)
+            if entry.is_file():
+                usage[1] += stat.st_size
+
+        for entry in os.scandir(self.uploads_dir):
+            record(entry.name.split(".")[0], entry)
+        for entry in os.scandir(self.sessions_dir):
+            record(entry.name, entry)
+            try:
+                for frame in os.scandir(entry.path):
+                    record(entry.name, frame)
+            except OSError:
+                pass
+        return sessions
+
+    def _live_pins(self):
+        # Sessions pinned by any process that is still refreshing its pins; stale pin directories are removed
+        pinned = set()
+        now = time.time()
+        for owner in os.scandir(self.pins_dir):
+            try:
+                refreshed = owner.stat().st_mtime
+                sessions = os.listdir(owner.path)
+            except OSError:
+                continue
+            if owner.path != self.owner_pins_dir and now - refreshed > self.pin_timeout:
+                shutil.rmtree(owner.path, ignore_errors=True)
+                continue
+            pinned.update(sessions)
+        with self._lock:
+            pinned.update(self._pinned)
+        return pinned
+
+    def _refresh_pins(self):
+        try:
+            os.utime(self.owner_pins_dir)
+        except OSError:
+            pass
+
+    def _delete_session(self, session_id):
+        self._remove(self.upload_path(session_id))
+        self._remove(self.upload_path(session_id) + ".part")
+        shutil.rmtree(os.path.join(self.sessions_dir, session_id), ignore_errors=True)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _sweep_forever(self, interval):
+        while True:
+            self._refresh_pins()
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping storage: {str(e)}")
+            time.sleep(interval)
+
+    def start(self, interval=STORAGE_SWEEP_SECONDS):
+        """Create the storage directories and start the sweeper, which first clears what dead processes left."""
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        os.makedirs(self.sessions_dir, exist_ok=True)
+        os.makedirs(self.pins_dir, exist_ok=True)
+        threading.Thread(target=self._sweep_forever, args=(interval,), name="storage-sweeper", daemon=True).start()
+
+# Started by init_app(), not at import
+storage = StorageManager()
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+class UploadRequest(Request):
+    """Request that writes multipart file parts straight into storage, where the video is kept as the upload."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spools = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = storage.open_spool(uuid.uuid4().hex)
+        self.spools.append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        # Parts that were not kept as a session's upload go with the request
+        for spool in self.spools:
+            storage.discard_spool(spool)
+
+app.request_class = UploadRequest
+
+# Histogram buckets (seconds) for pipeline stage timings
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-request stage totals for whichever job the current thread is working on
+active_timings = contextvars.ContextVar("active_timings", default=None)
+
+class StageTimings:
+    """Stage totals for one request, summed across every thread that worked on it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total = self._stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: {"seconds": round(total, 4), "count": count}
+                    for stage, (total, count) in sorted(self._stages.items())}
+
+class Metrics:
+    """Small Prometheus-style registry of histograms, counters and gauges."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> [per-bucket counts, sum, count]
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_gauge(self, name, amount, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    @contextmanager
+    def stage(self, stage):
+        """Time a pipeline stage, counting it as an error if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("video_stage_errors_total", stage=stage)
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    def record_stage(self, stage, seconds):
+        self.observe("video_stage_seconds", seconds, stage=stage)
+        timings = active_timings.get()
+        if timings is not None:
+            timings.add(stage, seconds)
+
+    @contextmanager
+    def in_progress(self, name, **labels):
+        self.add_gauge(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1, **labels)
+
+    def render(self, extra=()):
+        """Prometheus text exposition format; extra holds (name, type, value, labels) read at scrape time."""
+        def label_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count) in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{label_str(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{label_str(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{label_str(labels)} {total}")
+                lines.append(f"{name}_count{label_str(labels)} {count}")
+
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{label_str(labels)} {value}")
+
+        for name, kind, value, labels in extra:
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{label_str(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Gemini client pool settings
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", 8))
+GEMINI_KEEPALIVE_SECONDS = float(os.getenv("GEMINI_KEEPALIVE_SECONDS", 300))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 60))
+
+class FakeGeminiClient:
+    """Offline stand-in for genai.Client that answers after a fixed delay."""
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.models = self
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise genai_errors.ClientError(429, {"error": {"message": "Fake rate limit", "status": "RESOURCE_EXHAUSTED"}})
+        instruction = getattr(config, "system_instruction", "") or ""
+        if instruction == batch_classification_system_instructions:
+            num_images = sum(1 for part in contents if isinstance(part, Image.Image))
+            text = json.dumps([
+                {"frame": i, "category": "normal", "confidence": 0.9, "description": "Fake response."}
+                for i in range(1, num_images + 1)
+            ])
+        elif instruction == bounding_box_system_instructions:
+            text = '```json\n[{"box_2d": [100, 100, 500, 500], "label": "person"}]\n```'
+        else:
+            text = '{"category": "normal", "confidence": 0.9, "description": "Fake response."}'
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+        )
+
+def default_client_factory():
+    """Build a Gemini client, or the offline fake when GEMINI_BACKEND=fake."""
+    if os.getenv("GEMINI_BACKEND") == "fake":
+        return FakeGeminiClient(
+            latency=float(os.getenv("FAKE_GEMINI_LATENCY", 0.5)),
+            error_rate=float(os.getenv("FAKE_GEMINI_ERROR_RATE", 0)),
+        )
+    return genai.Client(
+        api_key=API_KEY,
+        http_options=types.HttpOptions(timeout=int(GEMINI_TIMEOUT_SECONDS * 1000)),
+    )
+
+class GeminiClientPool:
+    """Thread-safe pool of reusable Gemini clients shared by all workers."""
+
+    def __init__(self, size=GEMINI_POOL_SIZE, keepalive=GEMINI_KEEPALIVE_SECONDS, factory=default_client_factory):
+        self.size = size
+        self.keepalive = keepalive
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.created = 0
+
+    @contextmanager
+    def client(self):
+        """Borrow a client for one call, blocking while all of them are busy."""
+        self._slots.acquire()
+        try:
+            client = self._checkout()
+            try:
+                yield client
+            finally:
+                self._idle.put((client, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _checkout(self):
+        # Reuse the most recently returned client while its connections are still warm
+        while True:
+            try:
+                client, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - last_used < self.keepalive:
+                return client
+        with self._lock:
+            self.created += 1
+        return self.factory()
+
+    def set_factory(self, factory):
+        """Swap the client factory (e.g. for a fake backend) and drop idle clients."""
+        self.factory = factory
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+# Shared across every request and worker thread in the process
+gemini_pool = GeminiClientPool()
 
 def parse_json(json_output):
     """Parse JSON output from the model response."""
@@ -82,7 +629,7 @@ def parse_json(json_output):
             break  # Exit the loop once "```json" is found
     
     # Handle case where there's no markdown code block
-    if "```" not in json_output and "{" in json_output:
+    if "```" not in json_output and "{" in json_output and not json_output.lstrip().startswith("["):
         # Try to extract just the JSON object
         start_idx = json_output.find("{")
         end_idx = json_output.rfind("}") + 1
@@ -91,6 +638,27 @@ def parse_json(json_output):
     
     return json_output
 
+# Box colors, cycled through by box index
+BOX_COLORS = [
+    'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 
+    'brown', 'gray', 'beige', 'turquoise', 'cyan', 'magenta', 
+    'lime', 'navy', 'maroon', 'teal', 'olive', 'coral', 'lavender', 
+    'violet', 'gold', 'silver'
+] + [colorname for (colorname, colorcode) in ImageColor.colormap.items()]
+
+# Fonts tried in order; install fonts-noto-cjk on the host for Japanese labels
+FONT_CANDIDATES = ("NotoSansCJK-Regular.ttc", "Arial.ttf")
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    """Resolve the label font once per size instead of on every frame."""
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size=size)
+        except IOError:
+            continue
+    return ImageFont.load_default()
+
 def plot_bounding_boxes(im, bounding_boxes):
     """Plot bounding boxes on an image with labels."""
     img = im.copy()
@@ -99,31 +667,15 @@ def plot_bounding_boxes(im, bounding_boxes):
     # Create a drawing object
     draw = ImageDraw.Draw(img)
 
-    # Define colors
-    colors = [
-        'red', 'green', 'blue', 'yellow', 'orange', 'pink', 'purple', 
-        'brown', 'gray', 'beige', 'turquoise', 'cyan', 'magenta', 
-        'lime', 'navy', 'maroon', 'teal', 'olive', 'coral', 'lavender', 
-        'violet', 'gold', 'silver'
-    ] + [colorname for (colorname, colorcode) in ImageColor.colormap.items()]
-
     # Parse the bounding boxes
     bounding_boxes = parse_json(bounding_boxes)
-    
-    # Try to load a font
-    try:
-        font = ImageFont.truetype("NotoSansCJK-Regular.ttc", size=20)  # Increased font size for clarity
-    except IOError:
-        try:
-            font = ImageFont.truetype("Arial.ttf", size=20)  # Increased font size for clarity
-        except IOError:
-            font = ImageFont.load_default()
+    font = load_font(20)  # Increased font size for clarity
 
     # Iterate over the bounding boxes
     try:
         for i, bounding_box in enumerate(json.loads(bounding_boxes)):
             # Select a color from the list
-            color = colors[i % len(colors)]
+            color = BOX_COLORS[i % len(BOX_COLORS)]
 
             # Convert normalized coordinates to absolute coordinates
             abs_y1 = int(bounding_box["box_2d"][0]/1000 * height)
@@ -156,152 +708,758 @@ def plot_bounding_boxes(im, bounding_boxes):
 
     return img
 
-def classify_crime(image, session_id, frame_num):
+# Result cache settings (the disk tier is only used when RESULT_CACHE_DIR is set)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 2048))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_BYTES", 64 * 1024 * 1024))
+
+class ResultCache:
+    """Two-tier (memory LRU + optional disk) cache of model responses keyed by content hash."""
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, disk_dir=RESULT_CACHE_DIR, disk_bytes=RESULT_CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_used = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_used = sum(entry.stat().st_size for entry in os.scandir(disk_dir) if entry.is_file())
+
+    @staticmethod
+    def make_key(image, model_id, system_instruction, temperature):
+        """Hash the resized frame pixels together with everything that affects the answer."""
+        digest = hashlib.sha256()
+        digest.update(f"{model_id}|{temperature}|{image.mode}|{image.size}|".encode())
+        digest.update(system_instruction.encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_used,
+            }
+
+    def _memory_put(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = os.path.join(self.disk_dir, f"{key}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = f.read()
+            os.utime(path)  # Mark as recently used for eviction
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = os.path.join(self.disk_dir, f"{key}.txt")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(value)
+            with self._lock:
+                self._disk_used += os.path.getsize(path)
+                over_quota = self._disk_used > self.disk_bytes
+            if over_quota:
+                self._evict_disk()
+        except OSError as e:
+            print(f"Error writing result cache entry: {e}")
+
+    def _evict_disk(self):
+        # Drop the least recently used files until we are back under the quota
+        entries = sorted(
+            (entry for entry in os.scandir(self.disk_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        used = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if used <= self.disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                used -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_used = used
+
+result_cache = ResultCache()
+
+# Dispatcher settings (a rate of 0 disables the token bucket)
+GEMINI_RATE_LIMIT = float(os.getenv("GEMINI_RATE_LIMIT", 10))
+GEMINI_RATE_BURST = int(os.getenv("GEMINI_RATE_BURST", 20))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 4))
+GEMINI_BACKOFF_SECONDS = float(os.getenv("GEMINI_BACKOFF_SECONDS", 0.5))
+GEMINI_MAX_BACKOFF_SECONDS = float(os.getenv("GEMINI_MAX_BACKOFF_SECONDS", 20))
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def is_retryable(error):
+    """Rate limits, server errors and network timeouts are worth another attempt."""
+    code = getattr(error, "code", None)
+    if code in RETRYABLE_STATUS_CODES:
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in type(error).__name__
+
+class ModelDispatcher:
+    """Token-bucket rate limiting, retries with jittered backoff and AIMD concurrency control."""
+
+    # Let latency drift this far above the recent best before backing off
+    LATENCY_TOLERANCE = 2.0
+    # The best latency is forgotten at this half-life, so a backend that has become slower
+    # for good becomes the new baseline instead of holding the limit down forever
+    LATENCY_FLOOR_HALF_LIFE_SECONDS = 30.0
+    DECREASE_FACTOR = 0.7
+    DECREASE_COOLDOWN_SECONDS = 2.0
+
+    def __init__(self, rate=GEMINI_RATE_LIMIT, burst=GEMINI_RATE_BURST, max_retries=GEMINI_MAX_RETRIES,
+                 backoff=GEMINI_BACKOFF_SECONDS, max_backoff=GEMINI_MAX_BACKOFF_SECONDS,
+                 min_concurrency=1, max_concurrency=GEMINI_POOL_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = max(min_concurrency, max_concurrency // 2)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._successes_since_increase = 0
+        self._decreased_at = 0.0
+        self.latency_ewma = None
+        self.latency_floor = None
+        self._floor_updated_at = None
+        self.error_ewma = 0.0
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "throttled": 0}
+
+    def call(self, fn, cost=1):
+        """Run fn() under the rate and concurrency limits, retrying transient failures.
+
+        cost is the number of items the call carries (frames in a batch), so latency is
+        compared per item and batched calls don't look like a slowdown.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = getattr(e, "code", None) == 429
+                self._release(time.monotonic() - start, failed=True, throttled=throttled)
+                if not is_retryable(e) or attempt == self.max_retries:
+                    with self._cond:
+                        self.counters["failed"] += 1
+                    raise
+                with self._cond:
+                    self.counters["retries"] += 1
+                # Exponential backoff with "equal jitter" so retries from many workers spread out
+                delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+                time.sleep(delay / 2 + random.uniform(0, delay / 2))
+                continue
+            self._release((time.monotonic() - start) / max(cost, 1))
+            with self._cond:
+                self.counters["succeeded"] += 1
+            return result
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return {
+                "concurrency_limit": self.concurrency_limit,
+                "in_flight": self.in_flight,
+                "tokens": round(self._tokens, 2),
+                "rate_limit": self.rate,
+                "latency_ewma": self.latency_ewma,
+                "latency_floor": self.latency_floor,
+                "error_rate": round(self.error_ewma, 4),
+                **self.counters,
+            }
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                self._refill()
+                has_token = self.rate <= 0 or self._tokens >= 1
+                if has_token and self.in_flight < self.concurrency_limit:
+                    if self.rate > 0:
+                        self._tokens -= 1
+                    self.in_flight += 1
+                    self.counters["calls"] += 1
+                    return
+                # Sleep until a token is due or another call finishes
+                wait = (1 - self._tokens) / self.rate if not has_token else None
+                self._cond.wait(wait)
+
+    def _release(self, latency, failed=False, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            self.error_ewma = 0.9 * self.error_ewma + (0.1 if failed else 0.0)
+            now = time.monotonic()
+            if throttled:
+                self.counters["throttled"] += 1
+            if failed:
+                # Multiplicative decrease, at most once per cooldown so one burst of 429s counts once
+                if now - self._decreased_at > self.DECREASE_COOLDOWN_SECONDS:
+                    self.concurrency_limit = max(self.min_concurrency, int(self.concurrency_limit * self.DECREASE_FACTOR))
+                    self._decreased_at = now
+                    self._successes_since_increase = 0
+            else:
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                self._update_latency_floor(now)
+                self._successes_since_increase += 1
+                if self.latency_ewma > self.LATENCY_TOLERANCE * self.latency_floor:
+                    # The backend is slowing down, ease off one slot
+                    if self.concurrency_limit > self.min_concurrency and now - self._decreased_at > self.DECREASE_COOLDOWN_SECONDS:
+                        self.concurrency_limit -= 1
+                        self._decreased_at = now
+                    self._successes_since_increase = 0
+                elif self._successes_since_increase >= self.concurrency_limit and self.concurrency_limit < self.max_concurrency:
+                    # Additive increase after a full window of healthy calls
+                    self.concurrency_limit += 1
+                    self._successes_since_increase = 0
+            self._cond.notify_all()
+
+    def _update_latency_floor(self, now):
+        if self.latency_floor is None or self.latency_ewma <= self.latency_floor:
+            self.latency_floor = self.latency_ewma
+        else:
+            # Drift up towards the current latency, halving the gap every half-life
+            decay = 0.5 ** ((now - self._floor_updated_at) / self.LATENCY_FLOOR_HALF_LIFE_SECONDS)
+            self.latency_floor = self.latency_ewma - (self.latency_ewma - self.latency_floor) * decay
+        self._floor_updated_at = now
+
+# Every model call in the process goes through this dispatcher
+model_dispatcher = ModelDispatcher()
+
+def call_model(contents, system_instruction, temperature):
+    """Send one generate_content request through the dispatcher and shared client pool."""
+    def send():
+        with gemini_pool.client() as client:
+            response = client.models.generate_content(
+                model=MODEL_ID,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    system_instruction=system_instruction,
+                    temperature=temperature,
+                    safety_settings=safety_settings(),
+                )
+            )
+        return response.text
+
+    # Batched calls carry several frames, so the dispatcher judges their latency per frame
+    frames = sum(1 for part in contents if isinstance(part, Image.Image))
+    with metrics.in_progress("video_model_calls_in_progress"), metrics.stage("model_call"):
+        return model_dispatcher.call(send, cost=frames)
+
+def generate_content(image, prompt, system_instruction, temperature, parse):
+    """Call the model for one resized frame, serving repeated frames from the result cache."""
+    key = ResultCache.make_key(image, MODEL_ID, system_instruction, temperature)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    text = call_model([prompt, image], system_instruction, temperature)
+
+    # Only keep answers the caller can actually use so a bad reply is retried next time
+    try:
+        parse(text)
+        result_cache.put(key, text)
+    except (ValueError, TypeError):
+        pass
+    return text
+
+def parse_classification(response_text):
+    """Parse a classification reply into its dict, unwrapping a one-element array."""
+    data = json.loads(parse_json(response_text))
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict) or "category" not in data:
+        raise ValueError(f"Expected a classification object, got {type(data).__name__}")
+    return data
+
+def parse_boxes(response_text):
+    """Parse a bounding box reply, which must be a JSON array."""
+    boxes = json.loads(parse_json(response_text))
+    if not isinstance(boxes, list):
+        raise ValueError(f"Expected a list of boxes, got {type(boxes).__name__}")
+    return boxes
+
+# Frames are shrunk to fit this box before they reach the model
+MODEL_INPUT_SIZE = 640
+
+# Annotated frame encoding defaults ("inline" embeds base64, "url" serves frames by reference)
+DEFAULT_PAYLOAD_OPTIONS = {
+    "mode": "inline",
+    "format": "jpeg",
+    "quality": 80,
+    "max_size": MODEL_INPUT_SIZE,
+}
+IMAGE_FORMATS = {"jpeg": ("JPEG", "jpg", "image/jpeg"), "webp": ("WEBP", "webp", "image/webp")}
+
+def read_processing_options(form):
+    """Read the per-request processing parameters shared by the video endpoints."""
+    return {
+        "interval_seconds": float(form.get('interval', 2)),
+        "max_workers": int(form.get('workers', 5)),
+        "similarity_threshold": float(form.get('similarity', DEFAULT_SIMILARITY_THRESHOLD)),
+        "batch_size": int(form.get('batch_size', 1)),
+        "timings": form.get('timings', "false").lower() in ("1", "true", "yes"),
+        "decode": form.get('decode', "auto"),  # "auto", "sequential" or "sharded"
+        "sampling": form.get('sampling', "fixed"),  # "fixed" or "adaptive"
+        "budget": int(form.get('budget', ADAPTIVE_CALL_BUDGET)),
+        "coarse_interval": float(form.get('coarse_interval', ADAPTIVE_COARSE_INTERVAL)),
+        "min_interval": float(form.get('min_interval', ADAPTIVE_MIN_INTERVAL)),
+        "confidence_threshold": float(form.get('confidence_threshold', ADAPTIVE_CONFIDENCE_THRESHOLD)),
+        "payload": {
+            "mode": form.get('payload', DEFAULT_PAYLOAD_OPTIONS["mode"]),
+            "format": form.get('image_format', DEFAULT_PAYLOAD_OPTIONS["format"]).lower(),
+            "quality": int(form.get('image_quality', DEFAULT_PAYLOAD_OPTIONS["quality"])),
+            "max_size": int(form.get('image_size', DEFAULT_PAYLOAD_OPTIONS["max_size"])),
+        },
+    }
+
+def save_annotated_image(image, session_id, kind, frame_num, payload=None):
+    """Encode an annotated frame once, write it to disk and describe it for the response."""
+    with metrics.stage("encode"):
+        return _save_annotated_image(image, session_id, kind, frame_num, payload or DEFAULT_PAYLOAD_OPTIONS)
+
+def _save_annotated_image(image, session_id, kind, frame_num, payload):
+    pil_format, extension, mimetype = IMAGE_FORMATS.get(payload["format"], IMAGE_FORMATS["jpeg"])
+    if max(image.size) > payload["max_size"]:
+        image.thumbnail([payload["max_size"], payload["max_size"]], Image.Resampling.LANCZOS)
+
+    buffered = io.BytesIO()
+    image.save(buffered, format=pil_format, quality=payload["quality"])
+    image_bytes = buffered.getvalue()
+
+    output_path = os.path.join(storage.session_dir(session_id), f"{kind}_{frame_num}.{extension}")
+    with open(output_path, "wb") as f:
+        f.write(image_bytes)
+
+    result = {
+        "image_path": output_path,
+        "image_url": f"/sessions/{session_id}/frames/{frame_num}",
+        "image_mimetype": mimetype,
+        "image_bytes": len(image_bytes),
+    }
+    if payload["mode"] != "url":
+        # Convert the image to base64 for sending to frontend
+        result["image_data"] = base64.b64encode(image_bytes).decode('utf-8')
+    return result
+
+def classify_crime(image, session_id, frame_num, payload=None):
     """Classify the image for crime detection using Gemini."""
-    api_key = API_KEY
     try:
-        client = genai.Client(api_key=api_key)
         prompt = "Analyze this image and classify it according to the crime categories."
 
         # Resize image if needed
-        image_copy = image.copy()
-        image_copy.thumbnail([640, 640], Image.Resampling.LANCZOS)
+        with metrics.stage("resize"):
+            image_copy = fit_model_input(image)
 
         # Generate content with Gemini
-        response = client.models.generate_content(
-            model=MODEL_ID,
-            contents=[prompt, image_copy],
-            config=types.GenerateContentConfig(
-                system_instruction=crime_classification_system_instructions,
-                temperature=0.2,
-                safety_settings=safety_settings,
-            )
-        )
+        response_text = generate_content(image_copy, prompt, crime_classification_system_instructions, 0.2, parse_classification)
 
         # Parse the JSON response
-        classification_result = parse_json(response.text)
-        
         try:
-            classification_data = json.loads(classification_result)
-            
-            # Draw classification result on the image
-            draw = ImageDraw.Draw(image_copy)
-            
-            # Try to load a font
-            try:
-                font = ImageFont.truetype("NotoSansCJK-Regular.ttc", size=24)
-            except IOError:
-                try:
-                    font = ImageFont.truetype("Arial.ttf", size=24)
-                except IOError:
-                    font = ImageFont.load_default()
-            
-            # Get category and confidence
-            category = classification_data.get("category", "unknown")
-            confidence = classification_data.get("confidence", 0)
-            
-            # Determine color based on category (red for crimes, green for normal)
-            text_color = "red" if category != "normal" else "green"
-            
-            # Draw classification text
-            draw.rectangle(((0, 0), (image_copy.width, 60)), fill="black")
-            draw.text((10, 10), f"Category: {category.upper()}", fill=text_color, font=font)
-            draw.text((10, 35), f"Confidence: {confidence:.2f}", fill="white", font=font)
-            
-            # Save the classified image
-            output_path = os.path.join(PROCESSED_FOLDER, f"{session_id}_classified_{frame_num}.jpg")
-            image_copy.save(output_path)
-            
-            # Convert the image to base64 for sending to frontend
-            buffered = io.BytesIO()
-            image_copy.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            return {
-                "frame_num": frame_num,
-                "classification": classification_data,
-                "image_path": output_path,
-                "image_data": img_str
-            }
-        except json.JSONDecodeError as e:
+            with metrics.stage("parse_json"):
+                classification_data = parse_classification(response_text)
+        except ValueError as e:
             print(f"Error decoding classification JSON: {e}")
+            metrics.inc("video_frame_errors_total", reason="parse")
             return {
                 "frame_num": frame_num,
                 "classification": {"category": "error", "confidence": 0, "description": f"Error parsing result: {str(e)}"},
                 "error": f"JSON parse error: {str(e)}"
             }
-            
+        return annotate_classification(image_copy, classification_data, session_id, frame_num, payload)
+
     except Exception as e:
         print(f"Error classifying frame {frame_num}: {str(e)}")
+        metrics.inc("video_frame_errors_total", reason="model")
         return {
             "frame_num": frame_num,
             "classification": {"category": "error", "confidence": 0, "description": f"Error: {str(e)}"},
             "error": str(e)
         }
 
+def annotate_classification(image_copy, classification_data, session_id, frame_num, payload=None):
+    """Draw the classification banner on a resized frame and save it."""
+    with metrics.stage("draw"):
+        draw_classification(image_copy, classification_data)
+
+    # Save the classified image
+    return {
+        "frame_num": frame_num,
+        "classification": classification_data,
+        **save_annotated_image(image_copy, session_id, "classified", frame_num, payload)
+    }
+
+def draw_classification(image_copy, classification_data):
+    """Draw the category and confidence banner across the top of the frame."""
+    # Draw classification result on the image
+    draw = ImageDraw.Draw(image_copy)
+    font = load_font(24)
+    
+    # Get category and confidence
+    category = classification_data.get("category", "unknown")
+    confidence = classification_data.get("confidence", 0)
+    
+    # Determine color based on category (red for crimes, green for normal)
+    text_color = "red" if category != "normal" else "green"
+    
+    # Draw classification text
+    draw.rectangle(((0, 0), (image_copy.width, 60)), fill="black")
+    draw.text((10, 10), f"Category: {category.upper()}", fill=text_color, font=font)
+    draw.text((10, 35), f"Confidence: {confidence:.2f}", fill="white", font=font)
+
+def classify_crime_batch(frames, session_id, payload=None):
+    """Classify several frames in one Gemini request, falling back to single-frame calls."""
+    resized = []
+    classifications = {}
+    uncached = []
+    for frame_num, image in frames:
+        with metrics.stage("resize"):
+            image_copy = fit_model_input(image)
+        resized.append((frame_num, image, image_copy))
+
+        # Frames we have already seen are answered from the single-frame cache
+        key = ResultCache.make_key(image_copy, MODEL_ID, crime_classification_system_instructions, 0.2)
+        cached = result_cache.get(key)
+        if cached is not None:
+            classifications[frame_num] = parse_classification(cached)
+        else:
+            uncached.append((frame_num, image_copy, key))
+
+    if len(uncached) > 1:
+        contents = ["Analyze these images and classify each one according to the crime categories."]
+        for label, (_, image_copy, _) in enumerate(uncached, start=1):
+            contents += [f"Frame {label}:", image_copy]
+        try:
+            response_text = call_model(contents, batch_classification_system_instructions, 0.2)
+            with metrics.stage("parse_json"):
+                parsed = split_batch_response(response_text, len(uncached))
+        except Exception as e:
+            print(f"Error classifying batch of {len(uncached)} frames: {str(e)}")
+            parsed = {}
+        for label, (frame_num, _, key) in enumerate(uncached, start=1):
+            if label in parsed:
+                classifications[frame_num] = parsed[label]
+                result_cache.put(key, json.dumps(parsed[label]))
+
+    results = []
+    for frame_num, image, image_copy in resized:
+        if frame_num not in classifications:
+            # Missing or unparsable answer for this frame, ask about it on its own
+            results.append(classify_crime(image, session_id, frame_num, payload))
+            continue
+        try:
+            results.append(annotate_classification(image_copy, classifications[frame_num], session_id, frame_num, payload))
+        except Exception as e:
+            print(f"Error classifying frame {frame_num}: {str(e)}")
+            results.append({
+                "frame_num": frame_num,
+                "classification": {"category": "error", "confidence": 0, "description": f"Error: {str(e)}"},
+                "error": str(e)
+            })
+    return results
+
+def split_batch_response(response_text, num_frames):
+    """Map frame labels (1..num_frames) to classification dicts from a batched answer."""
+    try:
+        items = json.loads(parse_json(response_text))
+    except json.JSONDecodeError as e:
+        print(f"Error decoding batch classification JSON: {e}")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    parsed = {}
+    for position, item in enumerate(items, start=1):
+        if not isinstance(item, dict) or "category" not in item:
+            continue
+        label = item.pop("frame", position)
+        if isinstance(label, int) and 1 <= label <= num_frames:
+            parsed[label] = item
+    return parsed
+
+def classify_batch(frames, session_id, payload=None):
+    """Scheduler task: classify a list of frames, one request when there are several."""
+    if len(frames) == 1:
+        return [process_frame(frames[0], session_id, "crime_classification", payload)]
+    return classify_crime_batch(frames, session_id, payload)
+
+def to_model_image(frame, max_size=MODEL_INPUT_SIZE):
+    """Shrink a decoded BGR frame in OpenCV first, then convert colour on the small buffer."""
+    return Image.fromarray(shrink_frame(frame, max_size))
+
+def fit_model_input(image, max_size=MODEL_INPUT_SIZE):
+    """Return the frame itself when it already fits the model input, else a downscaled copy.
+
+    Frames from the decoder are already small and owned by the pipeline, so the
+    classifier draws on them in place instead of copying them first.
+    """
+    size = scaled_size(image.width, image.height, max_size)
+    if size == image.size:
+        return image
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+def iter_frames(video_path, interval_seconds=2):
+    """Decode a video front to back, yielding (frame_num, image) every X seconds."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        # Keep the fractional rate so 29.97 fps footage doesn't drift
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        frame_interval = max(fps * float(interval_seconds), 1.0)
+
+        frame_num = 0
+        sample_index = 0
+        next_sample = 0
+        started = time.perf_counter()
+        while True:
+            # grab() advances the decoder; only sampled frames pay for retrieve()'s copy and conversion
+            if not cap.grab():
+                break
+            if frame_num >= next_sample:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                image = to_model_image(frame)
+                # Only count time spent decoding, not time the consumer holds the generator
+                metrics.record_stage("decode", time.perf_counter() - started)
+                yield frame_num, image
+                started = time.perf_counter()
+                sample_index += 1
+                next_sample = int(round(sample_index * frame_interval))
+            frame_num += 1
+    finally:
+        cap.release()
+
+# Beyond this many frames it is cheaper to seek than to decode forward
+SEEK_GAP_FRAMES = 120
+
+def read_frames_at(video_path, frame_nums):
+    """Decode specific frame numbers in ascending order, seeking only across large gaps."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        position = 0  # Index of the next frame grab() would return
+        for target in sorted(set(frame_nums)):
+            started = time.perf_counter()
+            if target - position > SEEK_GAP_FRAMES:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position += 1
+            image = to_model_image(frame)
+            metrics.record_stage("decode", time.perf_counter() - started)
+            yield target, image
+    finally:
+        cap.release()
+
+# Long videos are decoded in parallel shards by a process pool
+SHARDED_DECODE_MIN_SECONDS = float(os.getenv("SHARDED_DECODE_MIN_SECONDS", 120))
+DECODE_PROCESSES = int(os.getenv("DECODE_PROCESSES", min(4, os.cpu_count() or 1)))
+SHARD_SAMPLES = int(os.getenv("SHARD_SAMPLES", 16))
+
+decode_pool = None
+decode_pool_lock = threading.Lock()
+
+def get_decode_pool():
+    """Start the shared decode process pool on first use."""
+    global decode_pool
+    with decode_pool_lock:
+        if decode_pool is None:
+            # spawn, not fork: this process already runs worker threads
+            decode_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=DECODE_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        return decode_pool
+
+def iter_frames_sharded(video_path, interval_seconds=2, max_size=MODEL_INPUT_SIZE):
+    """Like iter_frames, but decode shards of the video in worker processes.
+
+    Workers write small RGB frames into one shared memory block per shard and
+    shards are yielded strictly in frame order. At most two shards per process
+    are outstanding, so memory stays bounded on long videos.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+    frame_interval = max(fps * float(interval_seconds), 1.0)
+    samples = []
+    while int(round(len(samples) * frame_interval)) < total_frames:
+        samples.append(int(round(len(samples) * frame_interval)))
+    shards = [samples[i:i + SHARD_SAMPLES] for i in range(0, len(samples), SHARD_SAMPLES)]
+
+    out_width, out_height = scaled_size(width, height, max_size)
+    frame_shape = (out_height, out_width, 3)
+    frame_bytes = out_width * out_height * 3
+
+    pool = get_decode_pool()
+    in_flight = deque()
+    next_shard = 0
+    try:
+        while in_flight or next_shard < len(shards):
+            while next_shard < len(shards) and len(in_flight) < DECODE_PROCESSES * 2:
+                shard = shards[next_shard]
+                shm = shared_memory.SharedMemory(create=True, size=len(shard) * frame_bytes)
+                in_flight.append((shm, pool.submit(decode_shard, video_path, shard, max_size, shm.name, frame_shape)))
+                next_shard += 1
+
+            shm, future = in_flight.popleft()
+            try:
+                started = time.perf_counter()
+                decoded = future.result()
+                metrics.record_stage("decode", time.perf_counter() - started)
+                for slot, frame_num in enumerate(decoded):
+                    pixels = np.ndarray(frame_shape, dtype=np.uint8, buffer=shm.buf, offset=slot * frame_bytes)
+                    image = Image.fromarray(pixels)  # Copies out of the shared block
+                    del pixels
+                    yield frame_num, image
+            finally:
+                shm.close()
+                shm.unlink()
+    finally:
+        for shm, future in in_flight:
+            future.cancel()
+            try:
+                future.result()
+            except Exception:
+                pass
+            shm.close()
+            shm.unlink()
+
+def select_frame_source(video_path, interval_seconds, decode_mode="auto"):
+    """Pick the sequential or sharded decoder; "auto" shards videos above SHARDED_DECODE_MIN_SECONDS."""
+    if decode_mode == "auto":
+        fps, total_frames = video_properties(video_path)
+        long_video = total_frames / fps >= SHARDED_DECODE_MIN_SECONDS
+        decode_mode = "sharded" if long_video and DECODE_PROCESSES > 1 else "sequential"
+    if decode_mode == "sharded":
+        return iter_frames_sharded(video_path, interval_seconds)
+    return iter_frames(video_path, interval_seconds)
+
 def extract_frames(video_path, interval_seconds=2):
     """Extract frames from a video at specified intervals."""
-    cap = cv2.VideoCapture(video_path)
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return list(iter_frames(video_path, interval_seconds))
 
-    frame_interval = fps * interval_seconds  # Extract frames every X seconds
-    frames = []
+# Frames at least this similar to the last classified frame reuse its result
+DEFAULT_SIMILARITY_THRESHOLD = 0.97
+HASH_SIZE = 16
 
-    for frame_num in range(0, total_frames, frame_interval):
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-        ret, frame = cap.read()
-        if not ret:
-            break
-        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        frames.append((frame_num, image))
+def frame_hash(image, hash_size=HASH_SIZE):
+    """Difference hash of a downscaled grayscale copy of the frame."""
+    with metrics.stage("dedupe"):
+        small = image.resize((hash_size + 1, hash_size), Image.Resampling.BOX).convert("L")
+        pixels = np.asarray(small, dtype=np.int16)
+        return pixels[:, 1:] > pixels[:, :-1]
 
-    cap.release()
-    return frames
+def hash_similarity(hash_a, hash_b):
+    """Fraction of matching bits between two frame hashes (1.0 means identical)."""
+    return 1.0 - np.count_nonzero(hash_a != hash_b) / hash_a.size
 
-def process_frame(frame_data, session_id, process_type="bounding_box"):
+def suppress_duplicates(frames, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """Yield (frame_data, reference_frame_num), where the reference is None for scene changes."""
+    last_hash = None
+    last_frame_num = None
+    for frame_num, image in frames:
+        current_hash = frame_hash(image)
+        if last_hash is not None and hash_similarity(current_hash, last_hash) >= threshold:
+            yield (frame_num, image), last_frame_num
+            continue
+        last_hash = current_hash
+        last_frame_num = frame_num
+        yield (frame_num, image), None
+
+def detect_boxes(image):
+    """Ask Gemini for labelled boxes on a model-sized frame, returning the parsed list."""
+    prompt = "Detect the 2D bounding boxes (with 'label' as description')"
+    response_text = generate_content(image, prompt, bounding_box_system_instructions, 0.5, parse_boxes)
+    with metrics.stage("parse_json"):
+        boxes = parse_boxes(response_text)
+    return [box for box in boxes if isinstance(box, dict) and len(box.get("box_2d", [])) == 4]
+
+def process_frame(frame_data, session_id, process_type="bounding_box", payload=None):
     """Process a single frame with the Gemini model."""
     frame_num, image = frame_data
     
     if process_type == "crime_classification":
-        return classify_crime(image, session_id, frame_num)
+        return classify_crime(image, session_id, frame_num, payload)
     else:  # Default to bounding box detection
-        api_key = API_KEY
         try:
-            client = genai.Client(api_key=api_key)
-            prompt = "Detect the 2D bounding boxes (with 'label' as description')"
-
             # Resize image if needed
-            image_copy = image.copy()
-            image_copy.thumbnail([640, 640], Image.Resampling.LANCZOS)
+            with metrics.stage("resize"):
+                image_copy = fit_model_input(image)
 
-            # Generate content with Gemini
-            response = client.models.generate_content(
-                model=MODEL_ID,
-                contents=[prompt, image_copy],
-                config=types.GenerateContentConfig(
-                    system_instruction=bounding_box_system_instructions,
-                    temperature=0.5,
-                    safety_settings=safety_settings,
-                )
-            )
+            boxes = detect_boxes(image_copy)
 
             # Process the image with bounding boxes
-            processed_image = plot_bounding_boxes(image_copy, response.text)
+            with metrics.stage("draw"):
+                processed_image = plot_bounding_boxes(image_copy, json.dumps(boxes))
             
             # Save the processed image
-            output_path = os.path.join(PROCESSED_FOLDER, f"{session_id}_frame_{frame_num}.jpg")
-            processed_image.save(output_path)
-            
-            # Convert the image to base64 for sending to frontend
-            buffered = io.BytesIO()
-            processed_image.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
             return {
                 "frame_num": frame_num,
-                "image_path": output_path,
-                "image_data": img_str
+                "boxes": boxes,
+                **save_annotated_image(processed_image, session_id, "frame", frame_num, payload)
             }
         except Exception as e:
             print(f"Error processing frame {frame_num}: {str(e)}")
@@ -310,111 +1468,1375 @@ def process_frame(frame_data, session_id, process_type="bounding_box"):
                 "error": str(e)
             }
 
-def save_blob_to_video(blob_data):
-    """Save blob data to a temporary video file."""
-    # Create a unique filename
-    video_filename = f"{uuid.uuid4()}.mp4"
-    video_path = os.path.join(UPLOAD_FOLDER, video_filename)
-    
-    # Write the blob data to the file
-    with open(video_path, 'wb') as f:
-        f.write(blob_data)
-    
-    return video_path
+class ClassificationSummary:
+    """Overall classification for a video, updated one frame result at a time."""
+
+    def __init__(self):
+        self.frame_count = 0
+        self.category_counts = {}
+        self.confidence_sums = {}
+        self.descriptions = {}
+
+    def add(self, frame):
+        self.frame_count += 1
+        if "classification" not in frame:
+            return
+        classification = frame["classification"]
+        category = classification.get("category", "unknown")
+        self.category_counts[category] = self.category_counts.get(category, 0) + 1
+        self.confidence_sums[category] = self.confidence_sums.get(category, 0) + classification.get("confidence", 0)
+
+        # Keep up to 3 unique descriptions per category
+        descriptions = self.descriptions.setdefault(category, [])
+        description = classification.get("description")
+        if description and len(descriptions) < 3 and description not in descriptions:
+            descriptions.append(description)
+
+    def result(self):
+        # Find the most common category
+        most_common_category = max(self.category_counts.items(), key=lambda x: x[1]) if self.category_counts else ("unknown", 0)
+        category, count = most_common_category
+        return {
+            "category": category,
+            "confidence": self.confidence_sums.get(category, 0) / count if count else 0,
+            "frame_count": self.frame_count,
+            "category_distribution": dict(self.category_counts),
+            "descriptions": list(self.descriptions.get(category, []))
+        }
+
+# Global frame worker settings shared by every job
+FRAME_WORKERS = int(os.getenv("FRAME_WORKERS", 8))
+JOB_RUNNERS = int(os.getenv("JOB_RUNNERS", 4))
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", 3600))
+MAX_JOBS = int(os.getenv("MAX_JOBS", 100))  # Finished jobs beyond this are forgotten, oldest first
+
+class FrameScheduler:
+    """Fixed pool of frame workers that serves per-job queues round-robin."""
+
+    def __init__(self, workers=FRAME_WORKERS):
+        self.workers = workers
+        self._queues = OrderedDict()  # job_id -> deque of (future, fn, args, context)
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._started = False
+
+    def submit(self, job_id, fn, *args):
+        """Queue fn(*args) on behalf of a job and return its Future."""
+        future = concurrent.futures.Future()
+        # Run the task with the submitter's context so per-request timings follow the frame
+        context = contextvars.copy_context()
+        with self._cond:
+            if not self._started:
+                # Workers start with the first frame, so importing the module starts no threads
+                self._started = True
+                for i in range(self.workers):
+                    threading.Thread(target=self._run, name=f"frame-worker-{i}", daemon=True).start()
+            self._queues.setdefault(job_id, deque()).append((future, fn, args, context))
+            self._cond.notify()
+        return future
+
+    def cancel_job(self, job_id):
+        """Drop every frame a job still has queued."""
+        with self._cond:
+            tasks = self._queues.pop(job_id, ())
+        for future, _, _, _ in tasks:
+            future.cancel()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "queued": {job_id: len(tasks) for job_id, tasks in self._queues.items()},
+            }
+
+    def _next_task(self):
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            # Take one frame from the job at the front, then send that job to the back
+            job_id, tasks = next(iter(self._queues.items()))
+            task = tasks.popleft()
+            if tasks:
+                self._queues.move_to_end(job_id)
+            else:
+                del self._queues[job_id]
+            self._busy += 1
+            return task
+
+    def _run(self):
+        while True:
+            future, fn, args, context = self._next_task()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(context.run(fn, *args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+
+frame_scheduler = FrameScheduler()
+
+def classify_frames(video_path, session_id, options, is_cancelled=lambda: False):
+    """Classify a video's sampled frames, yielding each result as soon as it is ready."""
+    results_by_frame = {}
+    waiting_on = {}  # reference frame -> suppressed frames that reuse its result
+    retry = []  # duplicates of a frame that failed, which need their own model call
+
+    def with_inferred(result):
+        result["source"] = "classified"
+        results_by_frame[result["frame_num"]] = result
+        ready = [result]
+        for frame_data in waiting_on.pop(result["frame_num"], []):
+            if "error" in result:
+                # A failed reference says nothing about the frames that look like it
+                retry.append(frame_data)
+            else:
+                ready.append(inferred_result(frame_data[0], result))
+        return ready
+
+    def inferred_result(frame_num, reference):
+        return {
+            "frame_num": frame_num,
+            "classification": dict(reference.get("classification", {})),
+            "inferred_from": reference["frame_num"],
+            "source": "inferred"
+        }
+
+    # Decode frames lazily and hand each one to the shared scheduler as soon as it is ready.
+    # At most a few frames per job are in flight so memory stays bounded.
+    # Frames that look the same as the last classified one skip the model call.
+    max_pending = min(options["max_workers"], frame_scheduler.workers) * 2
+    batch_size = min(max(options.get("batch_size", 1), 1), MAX_BATCH_SIZE)
+    batch = []
+    pending = set()
+
+    def submit_batch():
+        pending.add(frame_scheduler.submit(session_id, classify_batch, list(batch), session_id, options["payload"]))
+        batch.clear()
+
+    def queue(frame_data):
+        batch.append(frame_data)
+        if len(batch) >= batch_size:
+            submit_batch()
+
+    def collect(done):
+        for future in done:
+            for result in future.result():
+                yield from with_inferred(result)
+        for frame_data in retry:
+            queue(frame_data)
+        retry.clear()
+
+    try:
+        source = select_frame_source(video_path, options["interval_seconds"], options.get("decode", "auto"))
+        frames = suppress_duplicates(source, options["similarity_threshold"])
+        for frame_data, reference_frame in frames:
+            if is_cancelled():
+                return
+            reference = results_by_frame.get(reference_frame)
+            if reference_frame is not None and reference is None:
+                # Duplicates keep their pixels until the reference's result is known
+                waiting_on.setdefault(reference_frame, []).append(frame_data)
+            elif reference is not None and "error" not in reference:
+                yield inferred_result(frame_data[0], reference)
+            else:
+                queue(frame_data)
+            # Wait on the model when too many frames are in flight or held back as duplicates
+            waiting = sum(len(frames) for frames in waiting_on.values())
+            while len(pending) >= max_pending or (waiting >= max_pending and (pending or batch)):
+                if batch and not pending:
+                    submit_batch()
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                yield from collect(done)
+                waiting = sum(len(frames) for frames in waiting_on.values())
+        # Every frame is decoded, so the source video can go while the model catches up
+        storage.release_upload(session_id)
+
+        while batch or pending:
+            if batch:
+                submit_batch()
+            if is_cancelled():
+                return
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            yield from collect(done)
+    finally:
+        # Don't keep calling the model for a job nobody is waiting on
+        frame_scheduler.cancel_job(session_id)
+        for future in pending:
+            future.cancel()
+
+def video_properties(video_path):
+    """Return (fps, total_frames) from the container metadata."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS) or 25.0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+
+def estimate_sample_count(video_path, interval_seconds):
+    """Roughly how many frames iter_frames will sample, for progress reporting."""
+    fps, total_frames = video_properties(video_path)
+    if total_frames <= 0:
+        return None
+    return math.ceil(total_frames / max(fps * interval_seconds, 1.0))
+
+# Adaptive sampling defaults: a sparse first pass, then bisection around suspicious windows
+ADAPTIVE_COARSE_INTERVAL = 8
+ADAPTIVE_MIN_INTERVAL = 0.5
+ADAPTIVE_CALL_BUDGET = 40
+ADAPTIVE_CONFIDENCE_THRESHOLD = 0.6
+
+def classify_on_scheduler(frames, session_id, options):
+    """Classify an already decoded list of frames on the shared scheduler, yielding results."""
+    batch_size = min(max(options.get("batch_size", 1), 1), MAX_BATCH_SIZE)
+    futures = [
+        frame_scheduler.submit(session_id, classify_batch, frames[i:i + batch_size], session_id, options["payload"])
+        for i in range(0, len(frames), batch_size)
+    ]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+def refinement_candidates(results, min_gap, confidence_threshold):
+    """Midpoints of sampled windows worth a closer look, most suspicious first."""
+    def is_suspicious(result):
+        classification = result.get("classification", {})
+        return (classification.get("category") != "normal"
+                or classification.get("confidence", 0) < confidence_threshold)
+
+    candidates = []
+    for left, right in zip(results, results[1:]):
+        gap = right["frame_num"] - left["frame_num"]
+        if gap < 2 * min_gap:
+            continue
+        changed = left["classification"].get("category") != right["classification"].get("category")
+        suspicious = is_suspicious(left) or is_suspicious(right)
+        if not (suspicious or changed):
+            continue
+        # Incidents first, then category boundaries; wider windows before narrower ones
+        priority = 0 if suspicious else 1
+        candidates.append((priority, -gap, left["frame_num"] + gap // 2))
+    candidates.sort()
+    return [frame_num for _, _, frame_num in candidates]
+
+def adaptive_classify_frames(video_path, session_id, options, is_cancelled=lambda: False):
+    """Coarse-to-fine sampling: classify a sparse pass, then bisect windows that look like incidents."""
+    fps, total_frames = video_properties(video_path)
+    budget = options.get("budget", ADAPTIVE_CALL_BUDGET)
+    min_gap = max(int(round(fps * options.get("min_interval", ADAPTIVE_MIN_INTERVAL))), 1)
+    confidence_threshold = options.get("confidence_threshold", ADAPTIVE_CONFIDENCE_THRESHOLD)
+
+    # Spend at most half of the budget on the first pass
+    coarse_interval = options.get("coarse_interval", ADAPTIVE_COARSE_INTERVAL)
+    if total_frames > 0:
+        coarse_interval = max(coarse_interval, total_frames / fps / max(budget // 2, 1))
+
+    results = []
+    calls = 0
+    round_num = 0
+    frames = list(select_frame_source(video_path, coarse_interval, options.get("decode", "auto")))[:budget]
+    while frames and not is_cancelled():
+        calls += len(frames)
+        for result in classify_on_scheduler(frames, session_id, options):
+            if is_cancelled():
+                return
+            result["source"] = "classified"
+            result["pass"] = round_num
+            results.append(result)
+            yield result
+        frames = None  # Drop the decoded images before the next round
+
+        results.sort(key=lambda x: x["frame_num"])
+        targets = refinement_candidates(results, min_gap, confidence_threshold)[:budget - calls]
+        if not targets:
+            break
+        frames = list(read_frames_at(video_path, targets))
+        round_num += 1
+    # No further round will read the source video
+    storage.release_upload(session_id)
+
+# Detection calls the model on keyframes only and carries boxes forward with optical flow.
+# A new keyframe is taken when tracking degrades, the scene changes or the gap grows too long.
+DETECT_INTERVAL_SECONDS = float(os.getenv("DETECT_INTERVAL_SECONDS", 0.2))
+DETECT_MAX_KEYFRAME_GAP = float(os.getenv("DETECT_MAX_KEYFRAME_GAP", 5))
+DETECT_MIN_TRACK_CONFIDENCE = float(os.getenv("DETECT_MIN_TRACK_CONFIDENCE", 0.5))
+DETECT_SCENE_SIMILARITY = float(os.getenv("DETECT_SCENE_SIMILARITY", 0.8))
+TRACK_POINTS_PER_BOX = 24
+TRACK_MAX_FB_ERROR = 1.5  # Pixels a point may miss by when tracked forward then back
+TRACK_LK_PARAMS = dict(winSize=(21, 21), maxLevel=3)
+TRACK_LK_ITERATIONS = 20
+TRACK_LK_EPSILON = 0.03
+
+class BoxTracker:
+    """Moves model boxes from frame to frame with sparse Lucas-Kanade optical flow."""
+
+    def __init__(self, gray, boxes):
+        height, width = gray.shape
+        self.gray = gray
+        self.labels = [box.get("label") for box in boxes]
+        # Pixel (x1, y1, x2, y2) from the model's normalized [y1, x1, y2, x2]
+        self.rects = []
+        for box in boxes:
+            y1, x1, y2, x2 = box["box_2d"]
+            self.rects.append(np.array([
+                min(x1, x2) / 1000 * width, min(y1, y2) / 1000 * height,
+                max(x1, x2) / 1000 * width, max(y1, y2) / 1000 * height
+            ], dtype=np.float32))
+        self.points = [self._seed(gray, rect) for rect in self.rects]
+
+    @staticmethod
+    def _seed(gray, rect):
+        x1, y1, x2, y2 = rect.astype(int)
+        mask = np.zeros_like(gray)
+        mask[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=TRACK_POINTS_PER_BOX, qualityLevel=0.01, minDistance=3, mask=mask)
+        return points if points is not None else np.empty((0, 1, 2), dtype=np.float32)
+
+    def update(self, gray):
+        """Track every box into the next frame and return the share of points that held up."""
+        counts = [len(points) for points in self.points]
+        if not sum(counts):
+            # Nothing textured to follow: keep the boxes where they are
+            self.gray = gray
+            return 1.0
+
+        previous = np.concatenate(self.points)
+        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, TRACK_LK_ITERATIONS, TRACK_LK_EPSILON)
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(self.gray, gray, previous, None, criteria=criteria, **TRACK_LK_PARAMS)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.gray, tracked, None, criteria=criteria, **TRACK_LK_PARAMS)
+        error = np.linalg.norm((previous - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < TRACK_MAX_FB_ERROR)
+
+        height, width = gray.shape
+        confidences = []
+        start = 0
+        for i, count in enumerate(counts):
+            if not count:
+                continue
+            keep = good[start:start + count]
+            old = previous[start:start + count][keep].reshape(-1, 2)
+            new = tracked[start:start + count][keep].reshape(-1, 2)
+            start += count
+            confidences.append(keep.mean())
+            if len(new) < 2:
+                self.points[i] = np.empty((0, 1, 2), dtype=np.float32)
+                continue
+
+            # Median motion is robust to the odd point that latched onto the background
+            dx, dy = np.median(new - old, axis=0)
+            old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+            new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.clip(np.median(new_spread[valid] / old_spread[valid]), 0.8, 1.25)) if valid.any() else 1.0
+
+            x1, y1, x2, y2 = self.rects[i]
+            cx, cy = (x1 + x2) / 2 + dx, (y1 + y2) / 2 + dy
+            half_w, half_h = (x2 - x1) / 2 * scale, (y2 - y1) / 2 * scale
+            self.rects[i] = np.clip(
+                np.array([cx - half_w, cy - half_h, cx + half_w, cy + half_h], dtype=np.float32),
+                0, [width, height, width, height]
+            ).astype(np.float32)
+            self.points[i] = new.reshape(-1, 1, 2)
+            if len(new) < TRACK_POINTS_PER_BOX // 2:
+                self.points[i] = self._seed(gray, self.rects[i])
+
+        self.gray = gray
+        return float(np.mean(confidences))
+
+    def boxes(self):
+        """Current boxes in the model's normalized [y1, x1, y2, x2] format."""
+        height, width = self.gray.shape
+        result = []
+        for label, (x1, y1, x2, y2) in zip(self.labels, self.rects):
+            box = {"box_2d": [int(y1 / height * 1000), int(x1 / width * 1000), int(y2 / height * 1000), int(x2 / width * 1000)]}
+            if label is not None:
+                box["label"] = label
+            result.append(box)
+        return result
+
+def read_detection_options(form):
+    """Processing options for box detection: the shared ones, with a denser default interval."""
+    options = read_processing_options(form)
+    options["task"] = "detect"
+    options["interval_seconds"] = float(form.get('interval', DETECT_INTERVAL_SECONDS))
+    return options
+
+def detect_frames(video_path, session_id, options, is_cancelled=lambda: False):
+    """Yield a box-annotated result for every sampled frame, querying the model only on keyframes."""
+    fps, _ = video_properties(video_path)
+    tracker = None
+    keyframe_num = None
+    keyframe_hash = None
+    for frame_num, image in iter_frames(video_path, options["interval_seconds"]):
+        if is_cancelled():
+            break
+        with metrics.stage("track"):
+            gray = np.asarray(image.convert("L"))
+        current_hash = frame_hash(image)
+
+        reason = None
+        confidence = 1.0
+        if tracker is None:
+            reason = "first"
+        elif (frame_num - keyframe_num) / fps >= DETECT_MAX_KEYFRAME_GAP:
+            reason = "interval"
+        elif hash_similarity(keyframe_hash, current_hash) < DETECT_SCENE_SIMILARITY:
+            reason = "scene_change"
+        else:
+            with metrics.stage("track"):
+                confidence = tracker.update(gray)
+            if confidence < DETECT_MIN_TRACK_CONFIDENCE:
+                reason = "low_confidence"
+
+        if reason:
+            try:
+                boxes = detect_boxes(image)
+            except Exception as e:
+                print(f"Error detecting boxes in frame {frame_num}: {str(e)}")
+                metrics.inc("video_frame_errors_total", reason="model")
+                yield {"frame_num": frame_num, "error": str(e)}
+                continue
+            metrics.inc("detect_keyframes_total", reason=reason)
+            tracker = BoxTracker(gray, boxes)
+            keyframe_num = frame_num
+            keyframe_hash = current_hash
+
+        boxes = tracker.boxes()
+        with metrics.stage("draw"):
+            annotated = plot_bounding_boxes(image, json.dumps(boxes))
+        yield {
+            "frame_num": frame_num,
+            "source": "keyframe" if reason else "tracked",
+            "keyframe_reason": reason,
+            "keyframe_num": keyframe_num,
+            "tracking_confidence": round(confidence, 3),
+            "boxes": boxes,
+            **save_annotated_image(annotated, session_id, "frame", frame_num, options["payload"])
+        }
+    storage.release_upload(session_id)
+
+class ClassificationJob:
+    """A video classification submitted through the job API."""
+
+    def __init__(self, job_id, video_path, options, detached=False, streaming=False):
+        self.job_id = job_id
+        self.video_path = video_path
+        self.options = options
+        # Detached jobs outlive the request that submitted them, so their results are kept
+        # for polling with the images left on disk rather than in memory
+        self.detached = detached
+        # Streamed jobs hand each frame to the client once, so its image isn't kept after that
+        self.streaming = streaming
+        self.status = "queued"
+        self.error = None
+        self.frames = []
+        self.summary = ClassificationSummary()
+        self.estimated_frames = None
+        self.timings = StageTimings() if options.get("timings") else None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+
+    def run(self):
+        if self._cancelled.is_set():
+            return self._finish("cancelled")
+        self.started_at = time.time()
+        self._set_status("running")
+        # Frames submitted from here inherit this context, so their stage timings land on this job
+        token = active_timings.set(self.timings)
+        try:
+            with metrics.in_progress("video_jobs_running"):
+                self._classify()
+        except Exception as e:
+            print(f"Error running job {self.job_id}: {str(e)}")
+            self.error = str(e)
+            return self._finish("failed")
+        finally:
+            active_timings.reset(token)
+        self._finish("cancelled" if self._cancelled.is_set() else "completed")
+
+    def _classify(self):
+        if self.options.get("task") == "detect":
+            self.estimated_frames = estimate_sample_count(self.video_path, self.options["interval_seconds"])
+            frames = detect_frames(self.video_path, self.job_id, self.options, is_cancelled=self._cancelled.is_set)
+        elif self.options["sampling"] == "adaptive":
+            self.estimated_frames = self.options["budget"]
+            frames = adaptive_classify_frames(self.video_path, self.job_id, self.options, is_cancelled=self._cancelled.is_set)
+        else:
+            self.estimated_frames = estimate_sample_count(self.video_path, self.options["interval_seconds"])
+            frames = classify_frames(self.video_path, self.job_id, self.options, is_cancelled=self._cancelled.is_set)
+        for frame in frames:
+            with self._cond:
+                self.summary.add(frame)
+                self.frames.append(frame)
+                self._cond.notify_all()
+
+    def cancel(self):
+        self._cancelled.set()
+        frame_scheduler.cancel_job(self.job_id)
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def wait(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    def iter_frames(self):
+        """Yield frame results as they arrive, raising if the job fails."""
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: index < len(self.frames) or self.done)
+                new_frames = self.frames[index:]
+                finished = self.done
+            for frame in new_frames:
+                yield self._with_image_data(frame)
+                if self.streaming:
+                    with self._cond:
+                        self.frames[index] = without_image_data(frame)
+                index += 1
+            if finished and index >= len(self.frames):
+                break
+        if self.status == "failed":
+            raise RuntimeError(self.error)
+
+    def progress(self):
+        with self._cond:
+            completed = len(self.frames)
+            inferred = sum(1 for frame in self.frames if frame.get("source") == "inferred")
+        fraction = None
+        if self.status == "completed":
+            fraction = 1.0
+        elif self.estimated_frames:
+            fraction = min(completed / self.estimated_frames, 0.99)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "frames_completed": completed,
+            "frames_classified": completed - inferred,
+            "frames_inferred": inferred,
+            "estimated_frames": self.estimated_frames,
+            "progress": fraction,
+            "error": self.error
+        }
+
+    def result(self, with_images=True):
+        with self._cond:
+            processed_frames = sorted(self.frames, key=lambda x: x["frame_num"])
+            overall_result = self.summary.result()
+        if with_images:
+            processed_frames = [self._with_image_data(frame) for frame in processed_frames]
+        if self.options.get("task") == "detect":
+            num_keyframes = sum(1 for frame in processed_frames if frame.get("source") == "keyframe")
+            result = {
+                "session_id": self.job_id,
+                "num_frames": len(processed_frames),
+                "num_keyframes": num_keyframes,
+                "num_tracked": sum(1 for frame in processed_frames if frame.get("source") == "tracked"),
+                "frames": processed_frames
+            }
+        else:
+            num_inferred = sum(1 for frame in processed_frames if frame["source"] == "inferred")
+            result = {
+                "session_id": self.job_id,
+                "num_frames": len(processed_frames),
+                "num_classified": len(processed_frames) - num_inferred,
+                "num_inferred": num_inferred,
+                "frames": processed_frames,
+                "overall_classification": overall_result
+            }
+        if self.timings is not None:
+            # Stage seconds are summed over all worker threads, so they can exceed the wall time
+            result["timings"] = {
+                "queued_seconds": round((self.started_at or self.created_at) - self.created_at, 4),
+                "total_seconds": round((self.finished_at or time.time()) - self.created_at, 4),
+                "stages": self.timings.as_dict()
+            }
+        return result
+
+    def _set_status(self, status):
+        with self._cond:
+            self.status = status
+            self._cond.notify_all()
+
+    def _with_image_data(self, frame):
+        # Inline images released by _release_images are read back from disk when asked for
+        if "image_data" in frame or "image_path" not in frame or self.options["payload"]["mode"] == "url":
+            return frame
+        try:
+            with open(frame["image_path"], "rb") as f:
+                return {**frame, "image_data": base64.b64encode(f.read()).decode('utf-8')}
+        except OSError:
+            return frame
+
+    def _release_images(self):
+        with self._cond:
+            self.frames = [without_image_data(frame) for frame in self.frames]
+
+    def _finish(self, status):
+        # The frame sources delete the video as soon as they are exhausted; this also covers
+        # jobs that failed or were cancelled before that point
+        storage.release(self.job_id)
+        if self.detached:
+            self._release_images()
+        self.finished_at = time.time()
+        metrics.inc("video_jobs_total", status=status)
+        metrics.observe("video_job_seconds", self.finished_at - self.created_at, status=status)
+        self._set_status(status)
+
+def without_image_data(frame):
+    """Copy a frame result without its inline image."""
+    return {key: value for key, value in frame.items() if key != "image_data"}
+
+# Jobs by ID, in submission order. Jobs answered by the request that submitted them are
+# dropped with the response; finished /jobs jobs are forgotten after JOB_TTL_SECONDS, or
+# sooner once more than MAX_JOBS are kept.
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+job_runner = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_RUNNERS, thread_name_prefix="job-runner")
+
+def submit_job(video_path, session_id, options, detached=False, streaming=False):
+    """Register a classification job and queue it to run in the background."""
+    job = ClassificationJob(session_id, video_path, options, detached=detached, streaming=streaming)
+    now = time.time()
+    with jobs_lock:
+        finished = [job_id for job_id, old in jobs.items() if old.finished_at]
+        expired = [job_id for job_id in finished if now - jobs[job_id].finished_at > JOB_TTL_SECONDS]
+        for job_id in expired:
+            del jobs[job_id]
+        # Running jobs are never dropped, so the cap only holds while they are finishing
+        for job_id in [job_id for job_id in finished if job_id in jobs][:max(len(jobs) + 1 - MAX_JOBS, 0)]:
+            del jobs[job_id]
+        jobs[session_id] = job
+    job_runner.submit(job.run)
+    return job
+
+def forget_job(job):
+    """Drop a job once its submitting request has responded, cancelling it if it never finished."""
+    if not job.done:
+        job.cancel()
+    with jobs_lock:
+        jobs.pop(job.job_id, None)
+
+def forget_when_done(events, job):
+    """Pass a streamed response through, forgetting its job when the stream ends or is abandoned."""
+    try:
+        yield from events
+    finally:
+        forget_job(job)
+
+def stream_classification(job, stream_format):
+    """Serialize frame results and the closing summary as NDJSON lines or SSE events."""
+    def encode(event, payload):
+        return encode_event(event, payload, stream_format)
+
+    try:
+        for frame in job.iter_frames():
+            yield encode("frame", {"frame": frame})
+    except Exception as e:
+        yield encode("error", {"error": str(e)})
+        return
+
+    # The job has finished, so its running summary covers every frame streamed above
+    summary = job.summary
+    if summary.frame_count == 0:
+        yield encode("error", {"error": "Could not extract any frames from the video"})
+        return
+
+    yield encode("summary", {
+        "session_id": job.job_id,
+        "num_frames": summary.frame_count,
+        "overall_classification": summary.result()
+    })
+
+def encode_event(event, payload, stream_format):
+    """Serialize one event as an SSE message or an NDJSON line."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"type": event, **payload}) + "\n"
+
+def stream_detection(job, stream_format):
+    """Serialize box-annotated frames as they are produced, then the keyframe totals."""
+    try:
+        for frame in job.iter_frames():
+            yield encode_event("frame", {"frame": frame}, stream_format)
+    except Exception as e:
+        yield encode_event("error", {"error": str(e)}, stream_format)
+        return
+
+    summary = job.result(with_images=False)
+    if not summary.pop("frames"):
+        yield encode_event("error", {"error": "Could not extract any frames from the video"}, stream_format)
+        return
+    yield encode_event("summary", summary, stream_format)
+
+# Live streams: a reader thread samples frames into a small ring buffer that one classifier
+# thread drains. When classification falls behind, the oldest buffered frames are dropped,
+# so memory and latency stay flat however long a stream runs.
+LIVE_BUFFER_FRAMES = int(os.getenv("LIVE_BUFFER_FRAMES", 4))
+LIVE_KEEP_FRAMES = int(os.getenv("LIVE_KEEP_FRAMES", 50))  # Annotated images kept on disk per stream
+LIVE_SUBSCRIBER_QUEUE = int(os.getenv("LIVE_SUBSCRIBER_QUEUE", 100))
+LIVE_MAX_STREAMS = int(os.getenv("LIVE_MAX_STREAMS", 8))
+LIVE_RECONNECT_MAX_SECONDS = float(os.getenv("LIVE_RECONNECT_MAX_SECONDS", 30))
+LIVE_KEEPALIVE_SECONDS = float(os.getenv("LIVE_KEEPALIVE_SECONDS", 15))
+# Device indexes and local files are off by default so the API cannot read arbitrary paths
+LIVE_ALLOW_LOCAL_SOURCES = os.getenv("LIVE_ALLOW_LOCAL_SOURCES", "false").lower() in ("1", "true", "yes")
+LIVE_URL_SCHEMES = ("rtsp://", "rtsps://", "rtmp://", "http://", "https://")
+
+def redact_source(source):
+    """Hide credentials embedded in a stream URL before reporting it."""
+    scheme, sep, rest = source.partition("://")
+    if sep and "@" in rest.split("/", 1)[0]:
+        return f"{scheme}://***@{rest.split('@', 1)[1]}"
+    return source
+
+class LiveStream:
+    """Continuous classification of a camera, stream URL or looping file."""
+
+    def __init__(self, stream_id, source, options, loop=False):
+        self.stream_id = stream_id
+        self.source = source
+        self.options = options
+        self.loop = loop
+        self.is_file = os.path.isfile(source)
+        self.status = "starting"
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.category = None
+        self.last_result = None
+        self.frames_read = 0
+        self.frames_sampled = 0
+        self.frames_classified = 0
+        self.frames_dropped = 0
+        self.category_changes = 0
+        self._buffer = deque(maxlen=LIVE_BUFFER_FRAMES)
+        self._reader_done = False
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._saved_images = deque()
+        self._latencies = deque(maxlen=100)
+
+    def start(self):
+        # Keep the sweeper away from this stream's frames while it runs
+        storage.pin(self.stream_id)
+        threading.Thread(target=self._read, name=f"live-reader-{self.stream_id[:8]}", daemon=True).start()
+        threading.Thread(target=self._classify, name=f"live-classifier-{self.stream_id[:8]}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
 
+    @property
+    def done(self):
+        return self.status in ("ended", "failed", "stopped")
+
+    def subscribe(self, include_frames=False):
+        """Register an event queue; a slow subscriber loses its oldest events rather than growing it."""
+        events = queue.Queue(maxsize=LIVE_SUBSCRIBER_QUEUE)
+        with self._subscribers_lock:
+            self._subscribers.append((events, include_frames))
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            self._subscribers = [subscriber for subscriber in self._subscribers if subscriber[0] is not events]
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer)
+            latencies = list(self._latencies)
+        with self._subscribers_lock:
+            subscribers = len(self._subscribers)
+        last_frame = None
+        if self.last_result is not None:
+            last_frame = {key: value for key, value in self.last_result.items() if key not in ("image_data", "image_path")}
+        return {
+            "stream_id": self.stream_id,
+            "source": redact_source(self.source),
+            "status": self.status,
+            "error": self.error,
+            "category": self.category,
+            "frames_read": self.frames_read,
+            "frames_sampled": self.frames_sampled,
+            "frames_classified": self.frames_classified,
+            "frames_dropped": self.frames_dropped,
+            "category_changes": self.category_changes,
+            "buffered": buffered,
+            "subscribers": subscribers,
+            "latency_seconds": sum(latencies) / len(latencies) if latencies else None,
+            "uptime_seconds": round((self.finished_at or time.time()) - self.started_at, 3),
+            "last_frame": last_frame
+        }
+
+    def _read(self):
+        interval = self.options["interval_seconds"]
+        backoff = 1
+        cap = None
+        try:
+            while not self._stopped.is_set():
+                if cap is None:
+                    cap = open_live_source(self.source)
+                    if not cap.isOpened():
+                        cap.release()
+                        cap = None
+                        if self.is_file:
+                            raise ValueError("Could not open video source")
+                        self.status = "reconnecting"
+                        self._stopped.wait(backoff)
+                        backoff = min(backoff * 2, LIVE_RECONNECT_MAX_SECONDS)
+                        continue
+                    # Files are played back in real time so they behave like a camera
+                    fps = cap.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+                    frame_delay = 1 / fps if fps > 0 else 0
+                    frames_this_pass = 0
+                    next_read = next_sample = time.monotonic()
+
+                # grab() every frame so a live source never lags behind, retrieve() only samples
+                if not cap.grab():
+                    cap.release()
+                    cap = None
+                    if self.is_file:
+                        if not (self.loop and frames_this_pass):
+                            break
+                        continue  # Rewind a looping file straight away
+                    self.status = "reconnecting"
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, LIVE_RECONNECT_MAX_SECONDS)
+                    continue
+                if not frames_this_pass:
+                    # A source that opens but never delivers a frame hasn't recovered yet
+                    backoff = 1
+                    self.status = "running"
+                self.frames_read += 1
+                frames_this_pass += 1
+
+                now = time.monotonic()
+                if frame_delay:
+                    next_read += frame_delay
+                    if next_read > now:
+                        self._stopped.wait(next_read - now)
+                        now = time.monotonic()
+                if now < next_sample:
+                    continue
+                next_sample = now + interval
+                ret, frame = cap.retrieve()
+                if ret:
+                    self._enqueue(to_model_image(frame))
+        except Exception as e:
+            print(f"Error reading live stream {self.stream_id}: {str(e)}")
+            self.error = str(e)
+        finally:
+            if cap is not None:
+                cap.release()
+            with self._cond:
+                self._reader_done = True
+                self._cond.notify_all()
+
+    def _enqueue(self, image):
+        with self._cond:
+            if len(self._buffer) == self._buffer.maxlen:
+                # The deque drops the oldest frame on append; count it
+                self.frames_dropped += 1
+                metrics.inc("live_frames_dropped_total")
+            self._buffer.append((self.frames_sampled, time.time(), image))
+            self.frames_sampled += 1
+            self._cond.notify_all()
+
+    def _classify(self):
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._buffer or self._reader_done or self._stopped.is_set())
+                    if self._stopped.is_set() or not self._buffer:
+                        break
+                    frame_num, captured_at, image = self._buffer.popleft()
+                result = classify_crime(image, self.stream_id, frame_num, self.options["payload"])
+                latency = time.time() - captured_at
+                metrics.observe("live_frame_latency_seconds", latency)
+                result["captured_at"] = captured_at
+                with self._cond:
+                    self._latencies.append(latency)
+                self._record(result)
+        except Exception as e:
+            print(f"Error classifying live stream {self.stream_id}: {str(e)}")
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            if self._stopped.is_set():
+                self.status = "stopped"
+            else:
+                self.status = "failed" if self.error else "ended"
+            storage.release(self.stream_id)
+            self._publish("end", self.stats())
+
+    def _record(self, result):
+        self.frames_classified += 1
+        self.last_result = result
+        self._keep_image(result.get("image_path"))
+        self._publish("frame", {"frame": result}, frame=True)
+        if "error" in result:
+            return
+
+        category = result["classification"].get("category")
+        if category != self.category:
+            change = {
+                "stream_id": self.stream_id,
+                "frame_num": result["frame_num"],
+                "from": self.category,
+                "to": category,
+                "confidence": result["classification"].get("confidence"),
+                "description": result["classification"].get("description"),
+                "image_url": result.get("image_url"),
+                "captured_at": result["captured_at"]
+            }
+            self.category = category
+            self.category_changes += 1
+            metrics.inc("live_category_changes_total", category=category)
+            self._publish("change", change)
+
+    def _keep_image(self, path):
+        # Only the newest annotated frames stay on disk, so hours of streaming use constant space
+        if path:
+            self._saved_images.append(path)
+        while len(self._saved_images) > LIVE_KEEP_FRAMES:
+            try:
+                os.remove(self._saved_images.popleft())
+            except OSError:
+                pass
+
+    def _publish(self, event, payload, frame=False):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for events, include_frames in subscribers:
+            if frame and not include_frames:
+                continue
+            while True:
+                try:
+                    events.put_nowait((event, payload))
+                    break
+                except queue.Full:
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        pass
+
+def open_live_source(source):
+    """Open a stream URL, a device index or a local video file with OpenCV."""
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+# Live streams by ID; finished streams are forgotten after JOB_TTL_SECONDS
+streams = {}
+streams_lock = threading.Lock()
+
+# Heavy imports and fonts load in the background once the app is started, so the server
+# answers right away; /ready reports 503 until they are in place
+STARTED_AT = time.monotonic()
+warmup = {"ready": False, "seconds": None, "error": None}
+
+def warm_up():
+    """Import OpenCV and the Gemini SDK and resolve label fonts off the request path."""
+    try:
+        for module in (cv2, genai, types, genai_errors):
+            module.load()
+        safety_settings()
+        load_font(20)
+        load_font(24)
+        warmup["ready"] = True
+    except Exception as e:
+        print(f"Error warming up: {str(e)}")
+        warmup["error"] = str(e)
+    warmup["seconds"] = round(time.monotonic() - STARTED_AT, 3)
+
+initialized = False
+init_lock = threading.Lock()
+
+def init_app():
+    """Start storage cleanup and the warm-up; importing the module alone starts no threads and deletes nothing.
+
+    Decode worker processes import this module under spawn, so everything with a side
+    effect lives here. Called from __main__, or by the first request under a WSGI server.
+    """
+    global initialized
+    with init_lock:
+        if initialized:
+            return app
+        initialized = True
+    storage.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    return app
+
+@app.before_request
+def ensure_initialized():
+    if not initialized:
+        init_app()
+
+def receive_video(session_id):
+    """Stream the request's video to storage, from a multipart 'video' field or a raw video body.
+
+    Returns None if the request carries no video.
+    """
+    if 'video' in request.files:
+        stream = request.files['video'].stream
+    elif request.mimetype.startswith("video/") or request.mimetype == "application/octet-stream":
+        # Raw uploads are read straight off the socket; options then come from the query string
+        stream = request.stream
+    else:
+        return None
+    return storage.save_upload(stream, session_id)
+
+def upload_error(e):
+    """Response for an upload that is too large or does not fit in storage."""
+    if isinstance(e, StorageFullError):
+        return jsonify({"error": str(e)}), 507
+    return jsonify({"error": f"Video exceeds the {MAX_UPLOAD_BYTES} byte upload limit"}), 413
 
 @app.route('/classify-video', methods=['POST'])
 def classify_video():
     """Endpoint to classify a video for crime detection."""
     try:
-        if 'video' not in request.files:
-            return jsonify({"error": "No video file provided"}), 400
-        
-        video_file = request.files['video']
-        
         # Get processing parameters
-        interval_seconds = int(request.form.get('interval', 2))
-        max_workers = int(request.form.get('workers', 5))
+        options = read_processing_options(request.values)
+        stream_format = request.values.get('stream')  # "ndjson" or "sse" to stream results
         
         # Create a session ID for this processing job
         session_id = str(uuid.uuid4())
         
         # Save the video file
-        video_path = os.path.join(UPLOAD_FOLDER, f"{session_id}.mp4")
-        video_file.save(video_path)
-        
-        # Extract frames
-        frames = extract_frames(video_path, interval_seconds)
-        
-        if not frames:
+        video_path = receive_video(session_id)
+        if video_path is None:
+            return jsonify({"error": "No video file provided"}), 400
+
+        streaming = stream_format in ("ndjson", "sse")
+        job = submit_job(video_path, session_id, options, streaming=streaming)
+
+        if streaming:
+            mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+            return Response(
+                stream_with_context(forget_when_done(stream_classification(job, stream_format), job)),
+                mimetype=mimetype,
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        job.wait()
+        forget_job(job)
+        if job.status == "failed":
+            return jsonify({"error": job.error}), 500
+
+        result = job.result()
+        if not result["frames"]:
             return jsonify({"error": "Could not extract any frames from the video"}), 400
-        
-        # Process frames in parallel
-        processed_frames = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_frame = {
-                executor.submit(process_frame, frame_data, session_id, "crime_classification"): frame_data 
-                for frame_data in frames
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_frame):
-                frame_result = future.result()
-                processed_frames.append(frame_result)
-        
-        # Sort frames by frame number
-        processed_frames.sort(key=lambda x: x["frame_num"])
-        
-        # Determine overall classification
-        category_counts = {}
-        for frame in processed_frames:
-            if "classification" in frame:
-                category = frame["classification"].get("category", "unknown")
-                category_counts[category] = category_counts.get(category, 0) + 1
-        
-        # Find the most common category
-        most_common_category = max(category_counts.items(), key=lambda x: x[1]) if category_counts else ("unknown", 0)
-        
-        # Calculate average confidence for the most common category
-        avg_confidence = 0
-        count = 0
-        descriptions = []
-        for frame in processed_frames:
-            if "classification" in frame and frame["classification"].get("category") == most_common_category[0]:
-                avg_confidence += frame["classification"].get("confidence", 0)
-                count += 1
-                if "description" in frame["classification"] and frame["classification"]["description"] not in descriptions:
-                    descriptions.append(frame["classification"]["description"])
-        
-        if count > 0:
-            avg_confidence /= count
-        
-        # Create overall result
-        overall_result = {
-            "category": most_common_category[0],
-            "confidence": avg_confidence,
-            "frame_count": len(processed_frames),
-            "category_distribution": category_counts,
-            "descriptions": descriptions[:3]  # Include up to 3 unique descriptions
-        }
-        
+
         # Return the processed frames information
-        return jsonify({
-            "session_id": session_id,
-            "num_frames": len(processed_frames),
-            "frames": processed_frames,
-            "overall_classification": overall_result
-        })
+        return jsonify(result)
     
+    except (StorageFullError, RequestEntityTooLarge) as e:
+        return upload_error(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
-    # Install Noto fonts for Japanese characters if needed
+@app.route('/detect-video', methods=['POST'])
+def detect_video():
+    """Endpoint to draw object boxes on every sampled frame, calling the model on keyframes only."""
     try:
-        import subprocess
-        subprocess.run(["apt-get", "install", "-y", "fonts-noto-cjk"], check=True)
-    except:
-        print("Warning: Could not install Noto fonts. Text rendering might be affected.")
-    
+        # Get processing parameters
+        options = read_detection_options(request.values)
+        stream_format = request.values.get('stream')  # "ndjson" or "sse" to stream results
+
+        session_id = str(uuid.uuid4())
+        video_path = receive_video(session_id)
+        if video_path is None:
+            return jsonify({"error": "No video file provided"}), 400
+
+        streaming = stream_format in ("ndjson", "sse")
+        job = submit_job(video_path, session_id, options, streaming=streaming)
+
+        if streaming:
+            mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+            return Response(
+                stream_with_context(forget_when_done(stream_detection(job, stream_format), job)),
+                mimetype=mimetype,
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        job.wait()
+        forget_job(job)
+        if job.status == "failed":
+            return jsonify({"error": job.error}), 500
+
+        result = job.result()
+        if not result["frames"]:
+            return jsonify({"error": "Could not extract any frames from the video"}), 400
+        return jsonify(result)
+
+    except (StorageFullError, RequestEntityTooLarge) as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def find_job(job_id):
+    """Look up a job by ID, returning None if it is unknown or expired."""
+    with jobs_lock:
+        return jobs.get(job_id)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Endpoint to queue a video for classification and return its job ID immediately."""
+    try:
+        # Get processing parameters; task=detect queues box detection instead of classification
+        if request.values.get('task') == "detect":
+            options = read_detection_options(request.values)
+        else:
+            options = read_processing_options(request.values)
+
+        # The job ID doubles as the session ID for processed images
+        session_id = str(uuid.uuid4())
+        video_path = receive_video(session_id)
+        if video_path is None:
+            return jsonify({"error": "No video file provided"}), 400
+
+        job = submit_job(video_path, session_id, options, detached=True)
+        return jsonify({
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.job_id}",
+            "progress_url": f"/jobs/{job.job_id}/progress"
+        }), 202
+
+    except (StorageFullError, RequestEntityTooLarge) as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Endpoint to list known jobs and the shared scheduler's load."""
+    with jobs_lock:
+        job_list = list(jobs.values())
+    return jsonify({
+        "jobs": [{"job_id": job.job_id, "status": job.status} for job in job_list],
+        "scheduler": frame_scheduler.stats()
+    })
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Endpoint to get a job's status, including the full result once it has finished."""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job ID"}), 404
+
+    response = job.progress()
+    if job.status == "completed":
+        response.update(job.result())
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>/progress', methods=['GET'])
+def get_job_progress(job_id):
+    """Endpoint to get a job's progress without its frame results."""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job ID"}), 404
+    return jsonify(job.progress())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Endpoint to cancel a queued or running job."""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job ID"}), 404
+    if not job.done:
+        job.cancel()
+    return jsonify(job.progress())
+
+def find_stream(stream_id):
+    """Look up a live stream by ID, returning None if it is unknown or expired."""
+    with streams_lock:
+        return streams.get(stream_id)
+
+@app.route('/streams', methods=['POST'])
+def create_stream():
+    """Endpoint to start continuously classifying a camera, stream URL or looping file."""
+    try:
+        source = request.values.get('source', '').strip()
+        if not source:
+            return jsonify({"error": "No stream source provided"}), 400
+        if not source.lower().startswith(LIVE_URL_SCHEMES) and not LIVE_ALLOW_LOCAL_SOURCES:
+            return jsonify({"error": "Only rtsp, rtmp and http(s) stream URLs are allowed"}), 400
+
+        options = read_processing_options(request.values)
+        loop = request.values.get('loop', "false").lower() in ("1", "true", "yes")
+
+        now = time.time()
+        with streams_lock:
+            for stream_id in [stream_id for stream_id, old in streams.items()
+                              if old.finished_at and now - old.finished_at > JOB_TTL_SECONDS]:
+                del streams[stream_id]
+            if sum(1 for stream in streams.values() if not stream.done) >= LIVE_MAX_STREAMS:
+                return jsonify({"error": "Too many live streams running"}), 429
+            stream = LiveStream(str(uuid.uuid4()), source, options, loop)
+            streams[stream.stream_id] = stream
+        stream.start()
+        return jsonify({
+            "stream_id": stream.stream_id,
+            "status": stream.status,
+            "status_url": f"/streams/{stream.stream_id}",
+            "events_url": f"/streams/{stream.stream_id}/events"
+        }), 201
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    """Endpoint to list live streams and their state."""
+    with streams_lock:
+        stream_list = list(streams.values())
+    return jsonify({"streams": [stream.stats() for stream in stream_list]})
+
+@app.route('/streams/<stream_id>', methods=['GET'])
+def get_stream(stream_id):
+    """Endpoint to report a live stream's counters, current category and latest frame."""
+    stream = find_stream(stream_id)
+    if stream is None:
+        return jsonify({"error": "Unknown stream ID"}), 404
+    return jsonify(stream.stats())
+
+@app.route('/streams/<stream_id>/events', methods=['GET'])
+def stream_events(stream_id):
+    """Endpoint pushing category-change events (and optionally every frame) as SSE or NDJSON."""
+    stream = find_stream(stream_id)
+    if stream is None:
+        return jsonify({"error": "Unknown stream ID"}), 404
+    stream_format = request.args.get('stream', "sse")
+    include_frames = request.args.get('frames', "false").lower() in ("1", "true", "yes")
+    events = stream.subscribe(include_frames)
+
+    def generate():
+        try:
+            yield encode_event("status", stream.stats(), stream_format)
+            while True:
+                try:
+                    event, payload = events.get(timeout=LIVE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    if stream.done:
+                        yield encode_event("end", stream.stats(), stream_format)
+                        break
+                    # Keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n" if stream_format == "sse" else "\n"
+                    continue
+                yield encode_event(event, payload, stream_format)
+                if event == "end":
+                    break
+        finally:
+            stream.unsubscribe(events)
+
+    mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/streams/<stream_id>', methods=['DELETE'])
+def stop_stream(stream_id):
+    """Endpoint to stop a live stream."""
+    stream = find_stream(stream_id)
+    if stream is None:
+        return jsonify({"error": "Unknown stream ID"}), 404
+    stream.stop()
+    return jsonify(stream.stats())
+
+@app.route('/sessions/<session_id>/frames/<int:frame_num>', methods=['GET'])
+def get_session_frame(session_id, frame_num):
+    """Endpoint to fetch an annotated frame produced for a session."""
+    try:
+        session_id = str(uuid.UUID(session_id))
+    except ValueError:
+        return jsonify({"error": "Invalid session ID"}), 400
+
+    for kind in ("classified", "frame"):
+        for _, extension, mimetype in IMAGE_FORMATS.values():
+            path = storage.frame_path(session_id, f"{kind}_{frame_num}.{extension}")
+            if os.path.exists(path):
+                storage.touch(session_id)
+                # Frames never change once written, but they belong to one session, so only the client keeps them
+                response = send_file(path, mimetype=mimetype, conditional=True, max_age=86400)
+                response.headers["Cache-Control"] = "private, max-age=86400, immutable"
+                return response
+    return jsonify({"error": "Frame not found"}), 404
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness check: the process is up and serving requests."""
+    return jsonify({"status": "ok", "uptime_seconds": round(time.monotonic() - STARTED_AT, 3)})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness check: 503 until the background warm-up has finished."""
+    if not warmup["ready"]:
+        status = "failed" if warmup["error"] else "starting"
+        return jsonify({"status": status, **warmup}), 503
+    return jsonify({"status": "ready", **warmup})
+
+@app.route('/dispatcher/stats', methods=['GET'])
+def dispatcher_stats():
+    """Endpoint to report the model dispatcher's rate limit, concurrency and error state."""
+    return jsonify(model_dispatcher.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Endpoint exposing pipeline metrics in Prometheus text format."""
+    scheduler = frame_scheduler.stats()
+    dispatcher = model_dispatcher.stats()
+    cache = result_cache.stats()
+    disk = storage.stats()
+    with streams_lock:
+        live_running = sum(1 for stream in streams.values() if not stream.done)
+    extra = [
+        ("video_frame_workers_busy", "gauge", scheduler["busy"], {}),
+        ("video_frames_queued", "gauge", sum(scheduler["queued"].values()), {}),
+        ("gemini_concurrency_limit", "gauge", dispatcher["concurrency_limit"], {}),
+        ("gemini_calls_in_flight", "gauge", dispatcher["in_flight"], {}),
+        ("gemini_retries_total", "counter", dispatcher["retries"], {}),
+        ("gemini_throttled_total", "counter", dispatcher["throttled"], {}),
+        ("gemini_failed_total", "counter", dispatcher["failed"], {}),
+        ("result_cache_hits_total", "counter", cache["hits"], {}),
+        ("result_cache_misses_total", "counter", cache["misses"], {}),
+        ("storage_used_bytes", "gauge", disk["used_bytes"], {}),
+        ("storage_evicted_sessions_total", "counter", disk["evicted_sessions"], {}),
+        ("live_streams_running", "gauge", live_running, {}),
+    ]
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats():
+    """Endpoint to report disk usage of uploads and processed frames against the quota."""
+    return jsonify(storage.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Endpoint to report result cache hit and miss counters."""
+    return jsonify(result_cache.stats())
+
+if __name__ == '__main__':
+    init_app()
     port = int(os.environ.get('PORT', 6001))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,65 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def scaled_size(width, height, max_size):
+    """Size a frame of width x height takes once it is shrunk to fit in max_size."""
+    scale = max_size / max(width, height)
+    if scale >= 1:
+        return width, height
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+
+
+def shrink_frame(frame, max_size):
+    """Shrink a decoded BGR frame in OpenCV first, then convert colour on the small buffer."""
+    import cv2
+    height, width = frame.shape[:2]
+    size = scaled_size(width, height, max_size)
+    if size != (width, height):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def attach_shared_memory(name):
+    """Attach to a block the parent owns without this process trying to clean it up."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers the attach too, but pool workers share the
+        # parent's resource tracker, so the parent's unlink still clears it
+        return shared_memory.SharedMemory(name=name)
+
+
+def decode_shard(video_path, frame_nums, max_size, shm_name, frame_shape):
+    """Process pool task: decode a run of frame numbers straight into shared memory.
+
+    Frames are written back to back as RGB arrays of frame_shape. Returns the
+    frame numbers actually decoded, in slot order.
+    """
+    import cv2
+    shm = attach_shared_memory(shm_name)
+    cap = cv2.VideoCapture(video_path)
+    decoded = []
+    try:
+        frame_bytes = int(np.prod(frame_shape))
+        # One keyframe seek per shard, then read forward
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_nums[0])
+        position = frame_nums[0]
+        for target in frame_nums:
+            while position < target and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position += 1
+            rgb = shrink_frame(frame, max_size)
+            if rgb.shape != tuple(frame_shape):
+                rgb = cv2.resize(rgb, (frame_shape[1], frame_shape[0]), interpolation=cv2.INTER_AREA)
+            slot = np.ndarray(frame_shape, dtype=np.uint8, buffer=shm.buf, offset=len(decoded) * frame_bytes)
+            slot[:] = rgb
+            del slot
+            decoded.append(target)
+    finally:
+        cap.release()
+        shm.close()
+    return decoded
@@ -1,95 +1,699 @@
-from flask import Flask, request, jsonify
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, trim_messages
+from flask import Flask, Response, request, jsonify, stream_with_context
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 import uuid
-from typing import Dict, List, Optional
+import time
+import atexit
+import json
+import re
+import sqlite3
+import threading
+import zlib
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
 import os 
 
 app = Flask(__name__)
 os.environ["GOOGLE_API_KEY"] = os.getenv("API_KEY")  # Set your Google API key here
-# Initialize Google Gemini model with system instructions in the model config
-# Note: Gemini models handle system messages differently than other LLMs
-model = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    # Pass the system message here instead of in the chat history
-    system_instruction="You are a helpful assistant. Answer all the questions to the best of your ability.",
-)
 
-# Create prompt template without the system message (will be handled by model config)
+class FakeChatModel(BaseChatModel):
+    """Offline stand-in for ChatGoogleGenerativeAI that echoes, or streams the echo word by word."""
+    latency: float = 0.5
+    system_instruction: str = ""
+    token_delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply_tokens(self, messages) -> List[str]:
+        last_message = messages[-1].content if messages else ""
+        words = f"You said: {last_message}".split(" ")
+        return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Blocking calls wait for the whole answer, as a real model would
+        tokens = self._reply_tokens(messages)
+        time.sleep(self.latency + self.token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self._reply_tokens(messages):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(self.token_delay)
+
+    def get_num_tokens_from_messages(self, messages, tools=None) -> int:
+        # Rough local estimate, the fake has no tokenizer
+        return sum(len(str(msg.content)) // 4 + 1 for msg in messages)
+
+# Every language uses the same model; only the system instruction changes
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
+SYSTEM_INSTRUCTION = "You are a helpful assistant. Answer all the questions to the best of your ability."
+# Prebuilt chains kept per system instruction, and languages to build at startup (comma separated)
+CHAT_CHAIN_CACHE_SIZE = int(os.getenv("CHAT_CHAIN_CACHE_SIZE", 16))
+CHAT_WARM_LANGUAGES = [language.strip() for language in os.getenv("CHAT_WARM_LANGUAGES", "").split(",") if language.strip()]
+MAX_LANGUAGE_LENGTH = 64
+
+def system_instruction_for(language: str) -> str:
+    """System instruction asking for answers in the given language."""
+    if language.strip().lower() == "english":
+        return SYSTEM_INSTRUCTION
+    return f"You are a helpful assistant. Answer all the questions to the best of your ability in the {language.strip()} language."
+
+def build_chat_model(system_instruction: str) -> BaseChatModel:
+    """Build the chat model, or the offline fake when CHAT_BACKEND=fake."""
+    if os.getenv("CHAT_BACKEND") == "fake":
+        return FakeChatModel(
+            latency=float(os.getenv("FAKE_CHAT_LATENCY", 0.5)),
+            token_delay=float(os.getenv("FAKE_CHAT_TOKEN_DELAY", 0)),
+            system_instruction=system_instruction,
+        )
+    # Imported here: the Gemini SDK is slow to load and the fake backend never needs it
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # Initialize Google Gemini model with system instructions in the model config
+    # Note: Gemini models handle system messages differently than other LLMs
+    return ChatGoogleGenerativeAI(
+        model=CHAT_MODEL,
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        # Pass the system message here instead of in the chat history
+        system_instruction=system_instruction,
+    )
+
+# Create prompt template without the system message (will be handled by model config);
+# the chains built on it come from chain_cache, one per language
 prompt = ChatPromptTemplate.from_messages(
     [MessagesPlaceholder(variable_name="messages")]
 )
 
-# Create the chain
-chain = prompt | model
+# History is trimmed to this many tokens, counted locally rather than by the model API
+MAX_HISTORY_TOKENS = int(os.getenv("CHAT_MAX_HISTORY_TOKENS", 150))
+# Rough fit to Gemini's SentencePiece vocabulary: common English words are one token and
+# long ones ~6 characters each, digits and symbols one each, other scripts ~3 characters each
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|[0-9]|[^\x00-\x7f]+|[^\sA-Za-z0-9]")
+MESSAGE_TOKEN_OVERHEAD = 4  # Role and turn markers around every message
+
+def estimate_tokens(text) -> int:
+    """Deterministic local token estimate for a message's content."""
+    if not isinstance(text, str):
+        text = json.dumps(text)
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        if piece.isascii():
+            tokens += (len(piece) + 5) // 6 if piece.isalpha() else 1
+        else:
+            tokens += (len(piece) + 2) // 3
+    return tokens
+
+def count_message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(message.content) + MESSAGE_TOKEN_OVERHEAD
+
+def head_trim_count(token_counts: List[int], is_human: List[bool], total: int, max_tokens: int) -> int:
+    """How many messages to drop from the head so the rest fit in max_tokens and start on a human turn."""
+    drop = 0
+    while drop < len(token_counts) and total > max_tokens:
+        total -= token_counts[drop]
+        drop += 1
+    while drop < len(token_counts) and not is_human[drop]:
+        drop += 1
+    return drop
 
 # Create our own simple message history class
 class SimpleMessageHistory(BaseChatMessageHistory):
+    """In-memory history that counts each message's tokens once, when it is added."""
+
     def __init__(self):
-        self.messages = []
+        self._messages = []
+        self.token_counts = []
+        self.total_tokens = 0
+
+    @property
+    def messages(self):
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        self._messages = list(messages)
+        self.token_counts = [count_message_tokens(message) for message in self._messages]
+        self.total_tokens = sum(self.token_counts)
     
     def add_message(self, message):
-        self.messages.append(message)
+        tokens = count_message_tokens(message)
+        self._messages.append(message)
+        self.token_counts.append(tokens)
+        self.total_tokens += tokens
     
     def clear(self):
         self.messages = []
 
-# Message trimmer configuration 
-# Note: We exclude system messages since they're handled by the model config
-trimmer = trim_messages(
-    max_tokens=150,
-    strategy="last",
-    token_counter=model,
-    include_system=False,  # Changed to False since system message is in model config
-    allow_partial=False,
-    start_on="human"
-)
+    def trim(self, max_tokens: int) -> None:
+        """Drop the oldest messages using the running total, without recounting the rest."""
+        drop = head_trim_count(self.token_counts, [isinstance(m, HumanMessage) for m in self._messages],
+                               self.total_tokens, max_tokens)
+        if drop:
+            self.total_tokens -= sum(self.token_counts[:drop])
+            del self._messages[:drop]
+            del self.token_counts[:drop]
+
+# Chat history backend: "memory" keeps sessions in this process, "sqlite" shares them
+# between worker processes through one WAL-mode database file
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "memory")
+CHAT_HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "chat_history.db")
+CHAT_SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL_SECONDS", 24 * 3600))
+CHAT_MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", 10000))
+
+class MemoryHistoryStore:
+    """In-process session histories with an idle TTL and least-recently-used eviction."""
+
+    def __init__(self, ttl_seconds: float = CHAT_SESSION_TTL_SECONDS, max_sessions: int = CHAT_MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, List]" = OrderedDict()  # session_id -> [last_used, history]
+        self._lock = threading.Lock()
+
+    def create(self, session_id: str) -> BaseChatMessageHistory:
+        history = SimpleMessageHistory()
+        with self._lock:
+            self._sessions[session_id] = [time.time(), history]
+            self._evict()
+        return history
+
+    def get(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        """Return the session's history and mark it used, or None if it is unknown or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[0] > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            entry[0] = now
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self):
+        # Oldest entries sit at the front, so expired sessions are found there first
+        now = time.time()
+        while self._sessions:
+            session_id, (last_used, _) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+# Compact one-letter role codes for stored messages; upper case marks JSON-encoded content
+MESSAGE_ROLES = {HumanMessage: "h", AIMessage: "a", SystemMessage: "s"}
+ROLE_MESSAGES = {code: cls for cls, code in MESSAGE_ROLES.items()}
+
+class SQLiteMessageHistory(BaseChatMessageHistory):
+    """One session's messages, read from and written to the shared SQLite store."""
+
+    def __init__(self, store: "SQLiteHistoryStore", session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.load_messages(self.session_id)
+
+    @messages.setter
+    def messages(self, messages: List[BaseMessage]) -> None:
+        self.store.replace_messages(self.session_id, messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.store.append_messages(self.session_id, [message])
+
+    def add_messages(self, messages) -> None:
+        self.store.append_messages(self.session_id, list(messages))
+
+    def clear(self) -> None:
+        self.store.replace_messages(self.session_id, [])
+
+    def trim(self, max_tokens: int) -> None:
+        self.store.trim_messages(self.session_id, max_tokens)
+
+class SQLiteHistoryStore:
+    """Session histories in a WAL-mode SQLite file, shared by every worker process."""
+
+    def __init__(self, path: str = CHAT_HISTORY_DB, ttl_seconds: float = CHAT_SESSION_TTL_SECONDS,
+                 max_sessions: int = CHAT_MAX_SESSIONS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._local = threading.local()  # sqlite3 connections must stay on their own thread
+        self._schema_ready = False
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        # Idempotent, so threads racing on their first connection are harmless
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, seq);
+        """)
+        self._schema_ready = True
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; multi-statement writes open their own transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            # The database file is created with the first connection, not when the store is built
+            if not self._schema_ready:
+                self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def create(self, session_id: str) -> BaseChatMessageHistory:
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO sessions (session_id, last_used) VALUES (?, ?)", (session_id, now))
+            conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM sessions WHERE session_id IN "
+                "(SELECT session_id FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            )
+        return SQLiteMessageHistory(self, session_id)
+
+    def get(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        """Return the session's history and mark it used, or None if it is unknown or expired."""
+        now = time.time()
+        updated = self._connection().execute(
+            "UPDATE sessions SET last_used = ? WHERE session_id = ? AND last_used >= ?",
+            (now, session_id, now - self.ttl_seconds)
+        ).rowcount
+        return SQLiteMessageHistory(self, session_id) if updated else None
+
+    def delete(self, session_id: str) -> None:
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def load_messages(self, session_id: str) -> List[BaseMessage]:
+        rows = self._connection().execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        )
+        messages = []
+        for role, content in rows:
+            if role.isupper():
+                role, content = role.lower(), json.loads(content)
+            messages.append(ROLE_MESSAGES[role](content=content))
+        return messages
+
+    def append_messages(self, session_id: str, messages: List[BaseMessage]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._insert(conn, session_id, messages)
+
+    def replace_messages(self, session_id: str, messages: List[BaseMessage]) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._insert(conn, session_id, messages)
+
+    def trim_messages(self, session_id: str, max_tokens: int) -> None:
+        """Delete the oldest rows using the token counts stored alongside each message."""
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT seq, role, tokens FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            token_counts = [tokens for _, _, tokens in rows]
+            drop = head_trim_count(token_counts, [role.lower() == "h" for _, role, _ in rows],
+                                   sum(token_counts), max_tokens)
+            if drop:
+                conn.execute("DELETE FROM messages WHERE session_id = ? AND seq <= ?", (session_id, rows[drop - 1][0]))
+
+    @staticmethod
+    def _insert(conn, session_id, messages):
+        rows = []
+        for message in messages:
+            role = MESSAGE_ROLES.get(type(message), "a")
+            content = message.content
+            if not isinstance(content, str):
+                role, content = role.upper(), json.dumps(content)
+            rows.append((session_id, role, content, count_message_tokens(message)))
+        conn.executemany("INSERT INTO messages (session_id, role, content, tokens) VALUES (?, ?, ?, ?)", rows)
+
+def make_history_store():
+    """Build the history backend selected by CHAT_HISTORY_BACKEND."""
+    if CHAT_HISTORY_BACKEND == "sqlite":
+        return SQLiteHistoryStore()
+    return MemoryHistoryStore()
 
 # Storage for message histories
-store: Dict[str, SimpleMessageHistory] = {}
+history_store = make_history_store()
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """Get or create a message history for a session ID."""
-    if session_id not in store:
-        store[session_id] = SimpleMessageHistory()
-    return store[session_id]
-
-# Configure the model with message history
-with_message_history = RunnableWithMessageHistory(
-    chain,
-    get_session_history,
-    input_messages_key="messages"
-)
+    return history_store.get(session_id) or history_store.create(session_id)
+
+class ChainCache:
+    """Least-recently-used cache of prebuilt chains, one per system instruction.
+
+    Each entry holds the plain prompt | model chain, used for streaming, and
+    its history-aware RunnableWithMessageHistory wrapper.
+    """
+
+    def __init__(self, max_size: int = CHAT_CHAIN_CACHE_SIZE):
+        self.max_size = max_size
+        self._chains: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, language: str) -> RunnableWithMessageHistory:
+        """Return the history-aware chain answering in this language, building it on first use."""
+        return self._entry(language)[1]
 
-def trim_history(session_id: str) -> None:
-    """Trim message history using LangChain's trim_messages function."""
-    if session_id not in store:
+    def get_chain(self, language: str):
+        """Return the plain prompt | model chain for this language, without history handling."""
+        return self._entry(language)[0]
+
+    def _entry(self, language: str) -> tuple:
+        instruction = system_instruction_for(language)
+        with self._lock:
+            entry = self._chains.get(instruction)
+            if entry is not None:
+                self._chains.move_to_end(instruction)
+                return entry
+
+        # Build outside the lock; a racing request may build the same chain, which is harmless
+        language_chain = prompt | build_chat_model(instruction)
+        history_chain = RunnableWithMessageHistory(
+            language_chain,
+            get_session_history,
+            input_messages_key="messages"
+        )
+        return self.put(instruction, language_chain, history_chain)
+
+    def put(self, instruction: str, language_chain, history_chain: RunnableWithMessageHistory) -> tuple:
+        with self._lock:
+            entry = self._chains.setdefault(instruction, (language_chain, history_chain))
+            self._chains.move_to_end(instruction)
+            self.builds += 1
+            while len(self._chains) > self.max_size:
+                self._chains.popitem(last=False)
+            return entry
+
+    def warm(self, languages: List[str]) -> None:
+        """Build chains ahead of the first request for each language."""
+        for language in languages:
+            self._entry(language)
+
+chain_cache = ChainCache()
+
+def has_earlier_questions(session_id: str) -> bool:
+    """Whether the user has already sent a message in this session."""
+    history = history_store.get(session_id)
+    return history is not None and any(isinstance(m, HumanMessage) for m in history.messages)
+
+def trim_history(session_id: str, reserve_tokens: int = 0) -> None:
+    """Trim the history so it plus reserve_tokens fits in MAX_HISTORY_TOKENS."""
+    history = history_store.get(session_id)
+    if history is None:
         return
-    
-    history = store[session_id]
-    messages = history.messages
-    
-    # Filter out any system messages before trimming
-    messages = [msg for msg in messages if not isinstance(msg, SystemMessage)]
-    
-    # Apply trimming
-    trimmed_messages = trimmer.invoke(messages)
-    
-    # Update the store with trimmed messages
-    store[session_id].messages = trimmed_messages
+    history.trim(MAX_HISTORY_TOKENS - reserve_tokens)
+
+# Opt-in semantic answer cache: near-identical questions in the same language reuse an answer
+CHAT_SEMANTIC_CACHE = os.getenv("CHAT_SEMANTIC_CACHE", "false").lower() in ("1", "true", "yes")
+CHAT_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("CHAT_SEMANTIC_CACHE_THRESHOLD", 0.92))
+CHAT_SEMANTIC_CACHE_SIZE = int(os.getenv("CHAT_SEMANTIC_CACHE_SIZE", 1024))  # Answers kept per language
+CHAT_SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("CHAT_SEMANTIC_CACHE_TTL_SECONDS", 24 * 3600))
+# Shorter messages ("yes", "why?") depend on the conversation, so they always go to the model
+CHAT_SEMANTIC_CACHE_MIN_WORDS = int(os.getenv("CHAT_SEMANTIC_CACHE_MIN_WORDS", 3))
+# Same model and file the Node server's embeddings.js uses, so vectors are shared between them
+EMBEDDING_MODEL = "Xenova/all-MiniLM-L6-v2"
+# New vectors are written to the shared file in batches, at most once per this many seconds
+EMBEDDINGS_SAVE_DELAY_SECONDS = float(os.getenv("EMBEDDINGS_SAVE_DELAY_SECONDS", 5))
+EMBEDDINGS_CACHE_PATH = os.getenv(
+    "EMBEDDINGS_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server", ".embeddings.cache.json")
+)
+
+def normalize_question(text: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation before embedding."""
+    return " ".join(text.lower().split()).strip(" ?!.")
+
+class MiniLMEmbedder:
+    """all-MiniLM-L6-v2 sentence vectors, read from and added to the shared embeddings cache file."""
+
+    def __init__(self, cache_path: str = EMBEDDINGS_CACHE_PATH, save_delay: float = EMBEDDINGS_SAVE_DELAY_SECONDS):
+        from sentence_transformers import SentenceTransformer
+        # The Xenova model is the ONNX export of this one; both give unit-length mean-pooled vectors
+        self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+        self.cache_path = cache_path
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._unsaved = threading.Event()
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                self._vectors = json.load(f)
+        except (OSError, ValueError):
+            self._vectors = {}
+        # File I/O stays off the request path: misses only mark the cache as unsaved
+        threading.Thread(target=self._save_forever, name="embeddings-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def embed(self, text: str) -> np.ndarray:
+        key = f"{text}-{EMBEDDING_MODEL}"
+        with self._lock:
+            cached = self._vectors.get(key)
+        if cached is not None:
+            return np.asarray(cached, dtype=np.float32)
+
+        vector = self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+        with self._lock:
+            self._vectors[key] = vector.tolist()
+        self._unsaved.set()
+        return vector
+
+    def flush(self) -> None:
+        """Write any new vectors to the shared cache file now."""
+        with self._save_lock:
+            if self._unsaved.is_set():
+                self._unsaved.clear()
+                self._save()
+
+    def _save_forever(self):
+        while True:
+            self._unsaved.wait()
+            # Let the misses that arrive meanwhile go out in the same write
+            time.sleep(self.save_delay)
+            self.flush()
+
+    def _save(self):
+        # Merge with whatever the Node server wrote since we loaded, then swap the file in atomically
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+        except (OSError, ValueError):
+            on_disk = {}
+        with self._lock:
+            for key, vector in on_disk.items():
+                self._vectors.setdefault(key, vector)
+            merged = dict(self._vectors)
+        try:
+            partial = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump(merged, f)
+            os.replace(partial, self.cache_path)
+        except OSError as e:
+            print(f"Error writing embeddings cache: {e}")
+
+class FakeEmbedder:
+    """Offline stand-in for MiniLMEmbedder: a normalized hashed bag of words of the same size."""
+    dim = 384
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            vector[zlib.crc32(word.encode()) % self.dim] += 1
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticIndex:
+    """Fixed-size matrix of question vectors for one language, searched with one matrix product."""
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.answers: List[Optional[str]] = [None] * capacity
+        # Empty slots have -inf timestamps, so they never match and are filled first
+        self.created = np.full(capacity, -np.inf)
+        self.used = np.full(capacity, -np.inf)
+
+    def search(self, vector: np.ndarray, threshold: float, expired_before: float) -> Optional[str]:
+        scores = self.vectors @ vector
+        scores[self.created < expired_before] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        self.used[best] = time.time()
+        return self.answers[best]
+
+    def add(self, vector: np.ndarray, answer: str, expired_before: float) -> None:
+        # Take an empty or expired slot if there is one, else the least recently used
+        slot = int(np.argmin(np.where(self.created < expired_before, -np.inf, self.used)))
+        now = time.time()
+        self.vectors[slot] = vector
+        self.answers[slot] = answer
+        self.created[slot] = now
+        self.used[slot] = now
+
+class SemanticCache:
+    """Answers keyed by question meaning, with a separate index per language."""
+
+    def __init__(self, embedder, threshold: float = CHAT_SEMANTIC_CACHE_THRESHOLD,
+                 capacity: int = CHAT_SEMANTIC_CACHE_SIZE, ttl_seconds: float = CHAT_SEMANTIC_CACHE_TTL_SECONDS,
+                 min_words: int = CHAT_SEMANTIC_CACHE_MIN_WORDS):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.min_words = min_words
+        self._indexes: Dict[str, SemanticIndex] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _vector(self, question: str) -> Optional[np.ndarray]:
+        text = normalize_question(question)
+        if len(text.split()) < self.min_words:
+            return None
+        return self.embedder.embed(text)
+
+    def lookup(self, language: str, question: str) -> Optional[str]:
+        """Return a cached answer to a question close enough to this one, if any."""
+        vector = self._vector(question)
+        if vector is None:
+            return None
+        with self._lock:
+            index = self._indexes.get(language.strip().lower())
+            answer = index.search(vector, self.threshold, time.time() - self.ttl_seconds) if index else None
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, language: str, question: str, answer: str) -> None:
+        vector = self._vector(question)
+        if vector is None or not answer:
+            return
+        with self._lock:
+            key = language.strip().lower()
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = SemanticIndex(len(vector), self.capacity)
+            index.add(vector, answer, time.time() - self.ttl_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "languages": {language: int(np.isfinite(index.created).sum()) for language, index in self._indexes.items()},
+            }
+
+def make_semantic_cache() -> Optional[SemanticCache]:
+    """Build the semantic cache if CHAT_SEMANTIC_CACHE is set and an embedder is available."""
+    if not CHAT_SEMANTIC_CACHE:
+        return None
+    if os.getenv("CHAT_BACKEND") == "fake":
+        return SemanticCache(FakeEmbedder())
+    try:
+        return SemanticCache(MiniLMEmbedder())
+    except Exception as e:
+        print(f"Warning: semantic cache disabled, could not load the embedding model: {e}")
+        return None
+
+# Loaded by the warm-up thread; questions skip the cache until the embedder is ready
+semantic_cache = None
+
+# Models, chains and the embedder are built in the background once the app is started, so
+# the server answers right away; /ready reports 503 until they are in place
+STARTED_AT = time.monotonic()
+warmup = {"ready": False, "seconds": None, "error": None}
+
+def warm_up() -> None:
+    """Build the English chain, the CHAT_WARM_LANGUAGES chains and the semantic cache off the request path."""
+    global semantic_cache
+    try:
+        chain_cache.warm(["English"] + CHAT_WARM_LANGUAGES)
+        semantic_cache = make_semantic_cache()
+        warmup["ready"] = True
+    except Exception as e:
+        print(f"Error warming up: {str(e)}")
+        warmup["error"] = str(e)
+    warmup["seconds"] = round(time.monotonic() - STARTED_AT, 3)
+
+initialized = False
+init_lock = threading.Lock()
+
+def init_app() -> Flask:
+    """Start the warm-up; importing the module alone starts no threads.
+
+    Called from __main__, or by the first request under a WSGI server.
+    """
+    global initialized
+    with init_lock:
+        if initialized:
+            return app
+        initialized = True
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    return app
+
+@app.before_request
+def ensure_initialized():
+    if not initialized:
+        init_app()
 
 @app.route('/chat/init', methods=['GET'])
 def initialize_session():
     """Initialize a new chat session."""
     session_id = str(uuid.uuid4())
-    history = get_session_history(session_id)
+    history = history_store.create(session_id)
     
     # Add initial AI message (no system message in history)
     initial_message = "Hi! How may I help you?"
@@ -106,7 +710,7 @@ def handle_message():
     data = request.json
     
     session_id = data.get('session_id')
-    if not session_id or session_id not in store:
+    if not session_id or history_store.get(session_id) is None:
         return jsonify({"error": "Invalid or expired session ID"}), 400
     
     user_message = data.get('message', '')
@@ -114,59 +718,141 @@ def handle_message():
     
     if not user_message:
         return jsonify({"error": "Message cannot be empty"}), 400
+    if not isinstance(language, str) or not language.strip() or len(language) > MAX_LANGUAGE_LENGTH:
+        return jsonify({"error": "Invalid language"}), 400
     
-    # Add user message to history
-    history = get_session_history(session_id)
-    history.add_message(HumanMessage(content=user_message))
-    
-    # Trim history before processing
-    trim_history(session_id)
-    
-    # Update system instruction with language preference if specified
-    if language != "English":
-        # Create a temporary model with language-specific system instruction
-        temp_model = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-001",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            system_instruction=f"You are a helpful assistant. Answer all the questions to the best of your ability in the {language} language.",
-        )
-        temp_chain = prompt | temp_model
-        
-        # Create temporary RunnableWithMessageHistory
-        temp_with_message_history = RunnableWithMessageHistory(
-            temp_chain,
-            get_session_history,
-            input_messages_key="messages"
-        )
-        
-        # Process the message with the temporary model
-        response = temp_with_message_history.invoke(
-            {"messages": [HumanMessage(content=user_message)]},
-            config={"configurable": {"session_id": session_id}}
-        )
-    else:
-        # Process the message with the default model
-        response = with_message_history.invoke(
-            {"messages": [HumanMessage(content=user_message)]},
-            config={"configurable": {"session_id": session_id}}
-        )
+    # Answers depend on the conversation so far, so only a session's opening question is
+    # shared through the semantic cache. Checked before trimming can drop earlier turns.
+    use_cache = semantic_cache is not None and not has_earlier_questions(session_id)
+
+    # Trim history before processing, leaving room for the new message; the chain
+    # adds the message to the history itself once the model has answered
+    message = HumanMessage(content=user_message)
+    trim_history(session_id, reserve_tokens=count_message_tokens(message))
+    
+    cached_answer = semantic_cache.lookup(language, user_message) if use_cache else None
+    if cached_answer is not None:
+        # Record the exchange as if the model had answered, so the conversation stays consistent
+        get_session_history(session_id).add_messages([message, AIMessage(content=cached_answer)])
+        return jsonify({
+            "session_id": session_id,
+            "message": cached_answer,
+            "cached": True
+        })
+    
+    # Chains are prebuilt per language, so non-English requests cost the same as English ones
+    response = chain_cache.get(language).invoke(
+        {"messages": [message]},
+        config={"configurable": {"session_id": session_id}}
+    )
+    if use_cache:
+        semantic_cache.store(language, user_message, message_text(response.content))
     
     return jsonify({
         "session_id": session_id,
         "message": response.content
     })
 
+def encode_event(event: str, payload: dict, stream_format: str) -> str:
+    """Serialize one event as an SSE message or an NDJSON line."""
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({"type": event, **payload}) + "\n"
+
+def message_text(content) -> str:
+    """Text of a message or chunk whose content may be a string or a list of parts."""
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+def stream_reply(session_id: str, message: HumanMessage, language: str, stream_format: str, use_cache: bool):
+    """Yield answer tokens as they arrive, then record the exchange in the session history."""
+    history = get_session_history(session_id)
+    cached_answer = semantic_cache.lookup(language, message.content) if use_cache else None
+    if cached_answer is not None:
+        history.add_messages([message, AIMessage(content=cached_answer)])
+        yield encode_event("token", {"text": cached_answer}, stream_format)
+        yield encode_event("done", {"session_id": session_id, "message": cached_answer, "cached": True}, stream_format)
+        return
+
+    parts = []
+    try:
+        for chunk in chain_cache.get_chain(language).stream({"messages": history.messages + [message]}):
+            text = message_text(chunk.content)
+            if text:
+                parts.append(text)
+                yield encode_event("token", {"text": text}, stream_format)
+    except Exception as e:
+        print(f"Error streaming reply for session {session_id}: {str(e)}")
+        yield encode_event("error", {"error": str(e)}, stream_format)
+        return
+
+    # Only a completed answer goes into the history; a client that disconnects
+    # mid-stream stops the generator before this point
+    reply = "".join(parts)
+    history.add_messages([message, AIMessage(content=reply)])
+    if use_cache:
+        semantic_cache.store(language, message.content, reply)
+    yield encode_event("done", {"session_id": session_id, "message": reply}, stream_format)
+
+@app.route('/chat/stream', methods=['POST'])
+def stream_message():
+    """Process a user message and stream the response token by token (SSE or NDJSON)."""
+    data = request.json
+    
+    session_id = data.get('session_id')
+    if not session_id or history_store.get(session_id) is None:
+        return jsonify({"error": "Invalid or expired session ID"}), 400
+    
+    user_message = data.get('message', '')
+    language = data.get('language', 'English')
+    stream_format = data.get('stream', 'sse')  # "sse" or "ndjson"
+    
+    if not user_message:
+        return jsonify({"error": "Message cannot be empty"}), 400
+    if not isinstance(language, str) or not language.strip() or len(language) > MAX_LANGUAGE_LENGTH:
+        return jsonify({"error": "Invalid language"}), 400
+    if stream_format not in ("sse", "ndjson"):
+        return jsonify({"error": "stream must be \"sse\" or \"ndjson\""}), 400
+    
+    # Only opening questions go through the semantic cache, as in handle_message
+    use_cache = semantic_cache is not None and not has_earlier_questions(session_id)
+    message = HumanMessage(content=user_message)
+    trim_history(session_id, reserve_tokens=count_message_tokens(message))
+    
+    mimetype = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return Response(
+        stream_with_context(stream_reply(session_id, message, language, stream_format, use_cache)),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness check: the process is up and serving requests."""
+    return jsonify({"status": "ok", "uptime_seconds": round(time.monotonic() - STARTED_AT, 3)})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness check: 503 until the background warm-up has finished."""
+    if not warmup["ready"]:
+        status = "failed" if warmup["error"] else "starting"
+        return jsonify({"status": status, **warmup}), 503
+    return jsonify({"status": "ready", **warmup})
+
+@app.route('/chat/cache/stats', methods=['GET'])
+def semantic_cache_stats():
+    """Report semantic answer cache hits and entries per language."""
+    return jsonify(semantic_cache.stats() if semantic_cache else {"enabled": False})
+
 @app.route('/chat/history', methods=['GET'])
 def get_history():
     """Get the message history for a session."""
     session_id = request.args.get('session_id')
-    if not session_id or session_id not in store:
+    history = history_store.get(session_id) if session_id else None
+    if history is None:
         return jsonify({"error": "Invalid or expired session ID"}), 400
     
-    history = get_session_history(session_id)
     messages = [{"role": "system" if isinstance(msg, SystemMessage) else 
                        "human" if isinstance(msg, HumanMessage) else "ai", 
                 "content": msg.content} 
@@ -178,4 +864,7 @@ def get_history():
     })
 
 if __name__ == '__main__':
+    # The debug reloader runs this file twice; only the child it restarts serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_app()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,588 @@
+"""Offline end-to-end benchmark for the video classification and chatbot services.
+
+Generates synthetic videos with OpenCV, swaps Gemini for the local fakes
+(GEMINI_BACKEND=fake / CHAT_BACKEND=fake) and drives both Flask apps with
+concurrent in-process clients. Results are written as JSON so runs can be
+compared with --baseline.
+
+    python benchmark.py --preset quick --latency 0.2 --error-rate 0.05 --clients 4
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name, duration (s), frame size, fourcc, container
+PRESETS = {
+    "quick": [
+        ("10s-480p-mp4v", 10, (854, 480), "mp4v", ".mp4"),
+        ("10s-480p-mjpg", 10, (854, 480), "MJPG", ".avi"),
+    ],
+    "full": [
+        ("10s-480p-mp4v", 10, (854, 480), "mp4v", ".mp4"),
+        ("10s-480p-mjpg", 10, (854, 480), "MJPG", ".avi"),
+        ("30s-720p-mp4v", 30, (1280, 720), "mp4v", ".mp4"),
+        ("30s-720p-avc1", 30, (1280, 720), "avc1", ".mp4"),
+        ("60s-1080p-mp4v", 60, (1920, 1080), "mp4v", ".mp4"),
+        ("20s-2160p-mp4v", 20, (3840, 2160), "mp4v", ".mp4"),
+    ],
+}
+
+
+def make_video(path, seconds, size, fourcc, fps=29.97):
+    """Write a synthetic clip: a static scene with a moving object in the second half."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        return False
+    width, height = size
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    background = cv2.resize(background, size, interpolation=cv2.INTER_LINEAR)
+    total = int(seconds * fps)
+    for i in range(total):
+        frame = background.copy()
+        if i > total // 2:
+            x = int((i - total // 2) / (total / 2) * width)
+            cv2.circle(frame, (x, height // 2), height // 8, (0, 0, 255), -1)
+        cv2.putText(frame, str(i), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+    return True
+
+
+def load_module(name, path):
+    """Import a service by file path so both apps can live in one process."""
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    array = np.asarray(values)
+    return {
+        "p50": float(np.percentile(array, 50)),
+        "p95": float(np.percentile(array, 95)),
+        "p99": float(np.percentile(array, 99)),
+        "mean": float(array.mean()),
+    }
+
+
+class RssSampler:
+    """Track peak resident memory while a scenario runs."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss_kb(self):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        # Not Linux: fall back to the process-wide high-water mark
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, self._rss_kb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, self._rss_kb())
+
+
+def run_clients(num_clients, requests_per_client, work):
+    """Run work(client_index, request_index) from concurrent threads, returning latencies and errors."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        for request_index in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                work(index, request_index)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(num_clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def bench_video(video_app, scenarios, args, workdir):
+    # Ask the service for its own per-request stage breakdown
+    form = {"timings": "1", **dict(item.split("=", 1) for item in args.form)}
+    results = []
+    for name, seconds, size, fourcc, extension in scenarios:
+        path = os.path.join(workdir, name + extension)
+        if not make_video(path, seconds, size, fourcc):
+            print(f"Skipping {name}: codec {fourcc} is not available in this OpenCV build")
+            results.append({"scenario": name, "skipped": f"codec {fourcc} unavailable"})
+            continue
+
+        frames_done = []
+        stages = defaultdict(lambda: {"seconds": 0.0, "count": 0})
+        lock = threading.Lock()
+
+        def work(client_index, request_index):
+            client = video_app.app.test_client()
+            with open(path, "rb") as f:
+                response = client.post(
+                    "/classify-video",
+                    data={"video": (f, os.path.basename(path)), **form},
+                    content_type="multipart/form-data",
+                )
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+            body = response.get_json()
+            with lock:
+                frames_done.append((body["num_frames"], body.get("num_classified", body["num_frames"])))
+                for stage, totals in body.get("timings", {}).get("stages", {}).items():
+                    stages[stage]["seconds"] += totals["seconds"]
+                    stages[stage]["count"] += totals["count"]
+
+        with RssSampler() as rss:
+            latencies, errors, wall = run_clients(args.clients, args.requests, work)
+
+        total_frames = sum(frames for frames, _ in frames_done)
+        results.append({
+            "scenario": name,
+            "duration_seconds": seconds,
+            "resolution": f"{size[0]}x{size[1]}",
+            "codec": fourcc,
+            "requests": len(latencies),
+            "errors": len(errors),
+            "error_samples": errors[:3],
+            "frames": total_frames,
+            "model_frames": sum(classified for _, classified in frames_done),
+            "wall_seconds": round(wall, 4),
+            "frames_per_second": round(total_frames / wall, 3) if wall else None,
+            "latency": percentiles(latencies),
+            "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+            "stages": {stage: {"seconds": round(totals["seconds"], 4), "count": totals["count"]}
+                       for stage, totals in sorted(stages.items())},
+        })
+        print(f"{name}: {results[-1]['frames_per_second']} frames/s, "
+              f"p95 {results[-1]['latency']['p95']}, peak RSS {results[-1]['peak_rss_mb']} MB")
+    return results
+
+
+def bench_chat(chat_app, args):
+    client = chat_app.app.test_client()
+    sessions = [client.get("/chat/init").get_json()["session_id"] for _ in range(args.clients)]
+    questions = [
+        "What should I do if I'm being followed?",
+        "What is the police helpline number?",
+        "How do I report a stolen phone?",
+        "Is it safe to walk home alone at night?",
+    ]
+
+    def work(client_index, request_index):
+        response = chat_app.app.test_client().post("/chat/message", json={
+            "session_id": sessions[client_index],
+            "message": questions[request_index % len(questions)],
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    with RssSampler() as rss:
+        latencies, errors, wall = run_clients(args.clients, args.chat_messages, work)
+    result = {
+        "messages": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": round(wall, 4),
+        "messages_per_second": round(len(latencies) / wall, 3) if wall else None,
+        "latency": percentiles(latencies),
+        "peak_rss_mb": round(rss.peak_kb / 1024, 1),
+    }
+    print(f"chat: {result['messages_per_second']} messages/s, p95 {result['latency']['p95']}")
+
+    # Same questions through /chat/stream: time to the first token versus the whole answer
+    first_token = []
+    lock = threading.Lock()
+
+    def stream_work(client_index, request_index):
+        start = time.perf_counter()
+        response = chat_app.app.test_client().post("/chat/stream", json={
+            "session_id": sessions[client_index],
+            "message": questions[request_index % len(questions)],
+            "stream": "ndjson",
+        }, buffered=False)
+        events = []
+        for line in response.response:
+            for event in (line.decode() if isinstance(line, bytes) else line).splitlines():
+                events.append(json.loads(event)["type"])
+                if len(events) == 1:
+                    with lock:
+                        first_token.append(time.perf_counter() - start)
+        if response.status_code != 200 or events[-1] != "done":
+            raise RuntimeError(f"HTTP {response.status_code}: stream ended with {events[-1:]}")
+
+    latencies, errors, wall = run_clients(args.clients, args.chat_messages, stream_work)
+    result["stream"] = {
+        "messages": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "first_token": percentiles(first_token),
+        "latency": percentiles(latencies),
+    }
+    print(f"chat stream: first token p95 {result['stream']['first_token']['p95']}, "
+          f"complete p95 {result['stream']['latency']['p95']}")
+    return result
+
+
+TOKEN_SAMPLES = [
+    "What should I do if I'm being followed?",
+    "What is the police helpline number?",
+    "Call 112 or the women's helpline 1091 immediately, then share your live location with someone you trust.",
+    "Stay in a well-lit, crowded place, walk into a shop or a police booth, and avoid going home until you are sure "
+    "nobody is following you. If you feel threatened, shout for help and call the emergency number.",
+    "मुझे कोई फॉलो कर रहा है, मुझे क्या करना चाहिए?",
+    "என் தொலைபேசி திருடப்பட்டது, நான் எப்படி புகார் செய்வது?",
+    "FIR no. 2024/0457, filed 12-03-2024 at 21:45 (Sector 18) -- status: pending; contact: +91-98765-43210.",
+    "ok",
+]
+
+
+def reference_token_counter(chat_app):
+    """Gemini's own tokenizer, or None with the reason when it cannot be loaded offline.
+
+    The benchmark runs the fake chat model, whose counter is only a heuristic, so it is
+    never used as the reference.
+    """
+    try:
+        from google.genai.local_tokenizer import LocalTokenizer
+        tokenizer = LocalTokenizer(model_name=chat_app.CHAT_MODEL)
+        tokenizer.count_tokens(TOKEN_SAMPLES[0])
+        return lambda text: tokenizer.count_tokens(text).total_tokens, None
+    except Exception as e:
+        return None, f"Gemini local tokenizer unavailable: {type(e).__name__}: {e}"
+
+
+def bench_tokens(chat_app, args):
+    """Check the local token estimate against Gemini's tokenizer and time incremental trimming."""
+    from langchain_core.messages import AIMessage, HumanMessage, trim_messages
+
+    reference, unavailable = reference_token_counter(chat_app)
+    samples = []
+    for text in TOKEN_SAMPLES if reference else ():
+        started = time.perf_counter()
+        expected = reference(text)
+        reference_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        estimate = chat_app.estimate_tokens(text)
+        estimate_seconds = time.perf_counter() - started
+        samples.append({
+            "text": text[:40],
+            "reference": expected,
+            "estimate": estimate,
+            "error_pct": round((estimate - expected) / max(expected, 1) * 100, 1),
+            "reference_us": round(reference_seconds * 1e6, 1),
+            "estimate_us": round(estimate_seconds * 1e6, 1),
+        })
+
+    # Per-turn cost of keeping a long conversation trimmed, the old way and the new way. Without
+    # the real tokenizer both sides count with the local estimate, so only the trimming differs.
+    counter = reference or chat_app.estimate_tokens
+    turns = [HumanMessage(content=TOKEN_SAMPLES[i % len(TOKEN_SAMPLES)]) if i % 2 == 0
+             else AIMessage(content=TOKEN_SAMPLES[(i + 3) % len(TOKEN_SAMPLES)]) for i in range(400)]
+    trimmer = trim_messages(max_tokens=chat_app.MAX_HISTORY_TOKENS, strategy="last", include_system=False,
+                            allow_partial=False, start_on="human",
+                            token_counter=lambda messages: sum(counter(str(m.content)) for m in messages))
+    started = time.perf_counter()
+    messages = []
+    for message in turns:
+        messages = trimmer.invoke(messages + [message])
+    legacy_seconds = time.perf_counter() - started
+
+    history = chat_app.SimpleMessageHistory()
+    started = time.perf_counter()
+    for message in turns:
+        history.add_message(message)
+        history.trim(chat_app.MAX_HISTORY_TOKENS)
+    incremental_seconds = time.perf_counter() - started
+
+    result = {
+        "trim_us_per_turn": {
+            "trim_messages": round(legacy_seconds / len(turns) * 1e6, 1),
+            "incremental": round(incremental_seconds / len(turns) * 1e6, 1),
+        },
+    }
+    if reference:
+        errors = [abs(sample["error_pct"]) for sample in samples]
+        result["accuracy"] = {
+            "reference": "gemini local tokenizer",
+            "mean_abs_error_pct": round(sum(errors) / len(errors), 1),
+            "max_abs_error_pct": max(errors),
+            "samples": samples,
+        }
+        accuracy = (f"estimate vs gemini local tokenizer: mean |error| {result['accuracy']['mean_abs_error_pct']}%, "
+                    f"max {result['accuracy']['max_abs_error_pct']}%")
+    else:
+        result["accuracy"] = {"skipped": unavailable}
+        accuracy = "accuracy skipped, Gemini tokenizer unavailable"
+    print(f"tokens: {accuracy}; trimming {result['trim_us_per_turn']['trim_messages']} -> "
+          f"{result['trim_us_per_turn']['incremental']} us per turn")
+    return result
+
+
+def legacy_pixel_path(frame):
+    """The original per-frame path: full-size colour conversion, copy, then LANCZOS thumbnail."""
+    from PIL import Image
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    image_copy = image.copy()
+    image_copy.thumbnail([640, 640], Image.Resampling.LANCZOS)
+    return image_copy, [image, image_copy]
+
+
+def bench_pixel_path(video_app, args):
+    """Per-frame CPU time and allocations from decoded BGR frame to model input, old vs new."""
+    def compact_path(frame):
+        image = video_app.fit_model_input(video_app.to_model_image(frame))
+        return image, [image]
+
+    results = []
+    for height, width in ((480, 854), (1080, 1920), (2160, 3840)):
+        frame = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+        entry = {"resolution": f"{width}x{height}"}
+        for name, path in (("legacy", legacy_pixel_path), ("compact", compact_path)):
+            path(frame)  # Warm up
+            start = time.process_time()
+            for _ in range(args.pixel_iterations):
+                path(frame)
+            cpu_ms = (time.process_time() - start) / args.pixel_iterations * 1000
+
+            # NumPy/OpenCV buffers show up in tracemalloc; PIL keeps its own allocator,
+            # so its image buffers (4 bytes per RGB pixel) are counted separately
+            tracemalloc.start()
+            _, pil_images = path(frame)
+            _, numpy_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            pil_bytes = sum(image.width * image.height * 4 for image in pil_images)
+            entry[name] = {
+                "cpu_ms_per_frame": round(cpu_ms, 3),
+                "numpy_peak_mb": round(numpy_peak / 1024 / 1024, 2),
+                "pil_buffers_mb": round(pil_bytes / 1024 / 1024, 2),
+            }
+        results.append(entry)
+        print(f"pixel path {entry['resolution']}: legacy {entry['legacy']['cpu_ms_per_frame']} ms, "
+              f"compact {entry['compact']['cpu_ms_per_frame']} ms per frame")
+    return results
+
+
+def legacy_font_lookup(size):
+    """The original per-frame font resolution, repeated on every annotated frame."""
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("NotoSansCJK-Regular.ttc", size=size)
+    except IOError:
+        try:
+            return ImageFont.truetype("Arial.ttf", size=size)
+        except IOError:
+            return ImageFont.load_default()
+
+
+def bench_fonts(video_app, args):
+    """Per-frame cost of resolving the label font and palette, per-call lookups vs the cached ones."""
+    from PIL import ImageColor
+
+    def legacy(size):
+        colors = ['red', 'green', 'blue'] + [name for (name, code) in ImageColor.colormap.items()]
+        return legacy_font_lookup(size), colors
+
+    def cached(size):
+        return video_app.load_font(size), video_app.BOX_COLORS
+
+    result = {}
+    for name, lookup in (("legacy", legacy), ("cached", cached)):
+        lookup(24)  # Warm up
+        start = time.perf_counter()
+        for _ in range(args.font_iterations):
+            lookup(20)
+            lookup(24)
+        result[name] = {"us_per_frame": round((time.perf_counter() - start) / args.font_iterations * 1e6, 2)}
+    result["font"] = type(video_app.load_font(24)).__name__
+    print(f"fonts: legacy {result['legacy']['us_per_frame']} us, cached {result['cached']['us_per_frame']} us per frame "
+          f"({result['font']})")
+    return result
+
+
+# Run in a fresh interpreter: import a service, then poll /ready until its warm-up is done
+STARTUP_PROBE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+service = importlib.import_module(sys.argv[2])
+imported = time.perf_counter() - started
+client = service.app.test_client()
+deadline = started + 120
+while client.get("/ready").status_code != 200 and time.perf_counter() < deadline:
+    time.sleep(0.005)
+print(json.dumps({"import_seconds": imported, "ready_seconds": time.perf_counter() - started}))
+"""
+
+
+def bench_startup(args):
+    """Cold-start time of each service in a new interpreter: process start, import and time to /ready."""
+    results = []
+    for service, directory, module in (("video", "AI", "app_prv"), ("chat", "Chatbot", "app")):
+        runs = []
+        for _ in range(args.startup_runs):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE, os.path.join(HERE, directory), module],
+                cwd=os.path.join(HERE, directory), capture_output=True, text=True, timeout=180, check=True,
+            ).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            run["process_seconds"] = time.perf_counter() - started
+            runs.append(run)
+        entry = {"service": service, "runs": len(runs)}
+        for key in ("import_seconds", "ready_seconds", "process_seconds"):
+            entry[key] = round(statistics.median(run[key] for run in runs), 3)
+        results.append(entry)
+        print(f"startup {service}: import {entry['import_seconds']}s, ready {entry['ready_seconds']}s, "
+              f"process {entry['process_seconds']}s (median of {len(runs)})")
+    return results
+
+
+def compare(current, baseline_path):
+    """Print the change in throughput and p95 latency against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {entry["scenario"]: entry for entry in baseline.get("video", []) if "skipped" not in entry}
+    for entry in current.get("video", []):
+        old = previous.get(entry["scenario"])
+        if "skipped" in entry or old is None:
+            continue
+        fps_change = (entry["frames_per_second"] / old["frames_per_second"] - 1) * 100
+        p95_change = (entry["latency"]["p95"] / old["latency"]["p95"] - 1) * 100
+        print(f"{entry['scenario']}: frames/s {fps_change:+.1f}%, p95 latency {p95_change:+.1f}%")
+    if current.get("chat") and baseline.get("chat"):
+        p95_change = (current["chat"]["latency"]["p95"] / baseline["chat"]["latency"]["p95"] - 1) * 100
+        print(f"chat: p95 latency {p95_change:+.1f}%")
+    previous = {entry["service"]: entry for entry in baseline.get("startup", [])}
+    for entry in current.get("startup", []):
+        old = previous.get(entry["service"])
+        if old is not None:
+            print(f"startup {entry['service']}: ready {(entry['ready_seconds'] / old['ready_seconds'] - 1) * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake model calls that return 429")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=1, help="video uploads per client per scenario")
+    parser.add_argument("--chat-messages", type=int, default=10, help="chat messages per client")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake chat delay per streamed word in seconds")
+    parser.add_argument("--form", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra /classify-video form field, e.g. --form interval=1")
+    parser.add_argument("--skip-video", action="store_true")
+    parser.add_argument("--skip-chat", action="store_true")
+    parser.add_argument("--skip-tokens", action="store_true", help="skip the token estimate and trimming comparison")
+    parser.add_argument("--skip-pixel", action="store_true", help="skip the decoder-to-model pixel path comparison")
+    parser.add_argument("--pixel-iterations", type=int, default=20)
+    parser.add_argument("--skip-startup", action="store_true", help="skip the cold-start and font loading measurements")
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh interpreters started per service")
+    parser.add_argument("--font-iterations", type=int, default=200)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    # The services read these at import time
+    os.environ.setdefault("API_KEY", "offline-benchmark")
+    os.environ["GEMINI_BACKEND"] = "fake"
+    os.environ["CHAT_BACKEND"] = "fake"
+    os.environ["FAKE_GEMINI_LATENCY"] = str(args.latency)
+    os.environ["FAKE_GEMINI_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_CHAT_LATENCY"] = str(args.latency)
+    os.environ["FAKE_CHAT_TOKEN_DELAY"] = str(args.token_delay)
+    os.environ.setdefault("GEMINI_RATE_LIMIT", "0")
+    os.environ.setdefault("RESULT_CACHE_SIZE", "0")  # Measure the pipeline, not the cache
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Uploads and frames go to a private directory, never the one a running service uses
+        os.environ["STORAGE_DIR"] = os.path.join(workdir, "storage")
+        if not args.skip_startup:
+            results["startup"] = bench_startup(args)
+        if not (args.skip_video and args.skip_pixel and args.skip_startup):
+            video_app = load_module("video_app", os.path.join(HERE, "AI", "app_prv.py"))
+            # Start it as a server would and let the warm-up finish before anything is timed
+            video_app.init_app()
+            while not (video_app.warmup["ready"] or video_app.warmup["error"]):
+                time.sleep(0.01)
+        if not args.skip_video:
+            results["video"] = bench_video(video_app, PRESETS[args.preset], args, workdir)
+        if not args.skip_pixel:
+            results["pixel_path"] = bench_pixel_path(video_app, args)
+        if not args.skip_startup:
+            results["fonts"] = bench_fonts(video_app, args)
+        if not (args.skip_chat and args.skip_tokens):
+            chat_app = load_module("chat_app", os.path.join(HERE, "Chatbot", "app.py"))
+        if not args.skip_chat:
+            results["chat"] = bench_chat(chat_app, args)
+        if not args.skip_tokens:
+            results["tokens"] = bench_tokens(chat_app, args)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()